@@ -0,0 +1,57 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+from cache import CountingCache
+from models import AnalysisCacheEntry
+
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "256"))
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", "3600"))
+ANALYSIS_CACHE_PERSIST = os.getenv("ANALYSIS_CACHE_PERSIST", "false").lower() in ("1", "true", "yes")
+
+analysis_cache = CountingCache(maxsize=ANALYSIS_CACHE_SIZE, ttl=ANALYSIS_CACHE_TTL)
+persistent_hits = 0
+
+def analysis_cache_key(image_data: bytes, dict_of_vars: dict) -> str:
+    digest = hashlib.sha256()
+    digest.update(image_data)
+    digest.update(json.dumps(dict_of_vars, sort_keys=True, separators=(",", ":"), default=str).encode())
+    return digest.hexdigest()
+
+async def get_cached_analysis(key: str):
+    global persistent_hits
+    result = analysis_cache.get(key)
+    if result is not None or not ANALYSIS_CACHE_PERSIST:
+        return result
+
+    try:
+        entry = await AnalysisCacheEntry.get(key)
+    except Exception as e:
+        logging.warning(f"No se pudo leer la caché persistente de análisis: {e}")
+        return None
+    if entry is None or entry.expires_at.replace(tzinfo=timezone.utc) <= datetime.now(timezone.utc):
+        return None
+
+    persistent_hits += 1
+    analysis_cache.set(key, entry.result)
+    return entry.result
+
+async def store_cached_analysis(key: str, result: list):
+    analysis_cache.set(key, result)
+    if not ANALYSIS_CACHE_PERSIST:
+        return
+
+    entry = AnalysisCacheEntry(
+        id=key,
+        result=result,
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=ANALYSIS_CACHE_TTL)
+    )
+    try:
+        await entry.save()
+    except Exception as e:
+        logging.warning(f"No se pudo guardar el análisis en la caché persistente: {e}")
+
+def analysis_cache_stats() -> dict:
+    return {**analysis_cache.stats(), "persistent": ANALYSIS_CACHE_PERSIST, "persistent_hits": persistent_hits}
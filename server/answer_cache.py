@@ -0,0 +1,57 @@
+import os
+import re
+import unicodedata
+from decimal import Decimal, InvalidOperation
+from typing import Optional
+
+from cache import CountingCache
+from concurrency import request_fingerprint
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "true").lower() in ("1", "true", "yes")
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", "86400"))
+ANSWER_CACHE_MAX_HISTORY = int(os.getenv("ANSWER_CACHE_MAX_HISTORY", "4"))
+
+# TTLCache descarta primero lo vencido y luego lo usado menos recientemente.
+answer_cache = CountingCache(maxsize=ANSWER_CACHE_SIZE, ttl=ANSWER_CACHE_TTL)
+
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)?")
+# Los puntos y comas se quitan salvo entre dígitos, donde ya son separador decimal.
+PUNCTUATION_PATTERN = re.compile(r"[¿?¡!;:\"'`]+|(?<!\d)[.,]|[.,](?!\d)")
+# Mensajes que hablan del propio alumno o de algo anterior: la respuesta depende
+# de algo que no está en la clave y no se comparte.
+PERSONAL_PATTERN = re.compile(
+    r"\b(mi|mis|mio|mia|mios|mias|yo|nombre|llamo|nuestra|nuestro|pizarra|anterior|anteriores|dije|dijiste|arriba)\b"
+)
+
+def canonical_number(match: re.Match) -> str:
+    try:
+        value = Decimal(match.group(0).replace(",", "."))
+    except InvalidOperation:
+        return match.group(0)
+    return format(value.normalize(), "f")
+
+def normalize_message(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    text = NUMBER_PATTERN.sub(canonical_number, text)
+    text = PUNCTUATION_PATTERN.sub(" ", text)
+    return " ".join(text.split())
+
+def is_personal_context(message: str, history: list[dict]) -> bool:
+    # Con historial largo Gemini ve más contexto del que entra en la clave.
+    if len(history) > ANSWER_CACHE_MAX_HISTORY:
+        return True
+    if any(entry.get("analysis_result") or entry.get("image_id") for entry in history):
+        return True
+    return any(PERSONAL_PATTERN.search(normalize_message(text)) for text in
+               [message, *(entry.get("text", "") for entry in history)])
+
+def answer_cache_key(message: str, history: list[dict]) -> Optional[str]:
+    if not ANSWER_CACHE or is_personal_context(message, history):
+        return None
+    context = [(entry.get("sender", "user"), normalize_message(entry.get("text", ""))) for entry in history]
+    return request_fingerprint(normalize_message(message), context)
+
+def answer_cache_stats() -> dict:
+    return {**answer_cache.stats(), "enabled": ANSWER_CACHE}
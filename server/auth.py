@@ -1,4 +1,6 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -8,19 +10,48 @@ from pydantic import EmailStr
 from typing import Optional
 from uuid import UUID
 from models import User
+from cache import CountingCache
+from concurrency import password_gate, PASSWORD_MAX_CONCURRENCY
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+
+user_cache = CountingCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+# token -> (id de usuario, expiración); la expiración de cada token se revisa al leerlo
+token_cache = CountingCache(maxsize=TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+# Con min_rounds = max_rounds cualquier hash con otro costo se marca para
+# recalcular, así que cambiar BCRYPT_ROUNDS migra las contraseñas al iniciar sesión.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/token")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+# bcrypt tarda decenas de milisegundos por hash: corre en hilos propios y
+# password_gate limita cuántos esperan, para que una ráfaga de logins no
+# bloquee el event loop ni acapare el pool de hilos por defecto.
+password_pool = ThreadPoolExecutor(max_workers=PASSWORD_MAX_CONCURRENCY, thread_name_prefix="bcrypt")
+
+async def run_password_task(func, *args):
+    async with password_gate.slot():
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(password_pool, func, *args)
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_password(plain_password, hashed_password) -> tuple[bool, Optional[str]]:
+    return await run_password_task(pwd_context.verify_and_update, plain_password, hashed_password)
+
+async def get_password_hash(password) -> str:
+    return await run_password_task(pwd_context.hash, password)
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -34,12 +65,50 @@ async def get_user_by_email(email: EmailStr) -> Optional[User]:
 async def get_user_by_uuid(id: UUID) -> Optional[User]:
     return await User.find_one(User.id == id)
 
+def invalidate_user(user_id: UUID):
+    user_cache.pop(user_id)
+
+def copy_user(user: User) -> User:
+    # Cada petición recibe su propia copia para que un endpoint que modifique
+    # el usuario antes de guardarlo no altere la versión cacheada.
+    return user.model_copy()
+
+async def get_cached_user(user_id: UUID) -> Optional[User]:
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await get_user_by_uuid(id=user_id)
+        if user is None:
+            return None
+        user_cache.set(user_id, user)
+    return copy_user(user)
+
+def decode_token(token: str) -> UUID:
+    cached = token_cache.get(token)
+    if cached is not None:
+        user_id, expires_at = cached
+        if expires_at > datetime.now(timezone.utc).timestamp():
+            return user_id
+        token_cache.pop(token)
+
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    user_id_str = payload.get("sub")
+    if user_id_str is None:
+        raise ValueError("Token sin sujeto")
+    user_id = UUID(user_id_str)
+    token_cache.set(token, (user_id, float(payload["exp"])))
+    return user_id
+
 async def authenticate_user(email: EmailStr, password: str) -> Optional[User]:
     user = await get_user_by_email(email)
     if not user:
         return None
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await verify_password(password, user.hashed_password)
+    if not valid:
         return None
+    if new_hash:
+        user.hashed_password = new_hash
+        await user.save()
+        invalidate_user(user.id)
     return user
 
 async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
@@ -49,14 +118,10 @@ async def get_current_user(token: str = Depends(oauth2_scheme)) -> User:
         headers={"WWW-Authenticate": "Bearer"},
     )
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id_str = payload.get("sub")
-        if user_id_str is None:
-            raise credentials_exception
-        user_id = UUID(user_id_str)
-    except (JWTError, ValueError):
+        user_id = decode_token(token)
+    except (JWTError, ValueError, KeyError):
         raise credentials_exception
-    user = await get_user_by_uuid(id=user_id)
+    user = await get_cached_user(user_id)
     if user is None:
         raise credentials_exception
     return user
\ No newline at end of file
@@ -0,0 +1,120 @@
+import json
+import random
+import asyncio
+from types import SimpleNamespace
+
+# Reemplazos deterministas de google.generativeai: responden con el mismo texto
+# tras una latencia configurable, con la forma de objeto que esperan core.py
+# y chat_agent.py (text, candidates[0].content.parts, usage_metadata).
+
+DEFAULT_ANALYSIS = [{"expr": "2 + 3", "result": 5, "assign": False}]
+DEFAULT_CHAT_TEXT = (
+    "Para resolver una ecuación lineal dejamos la x sola: primero restamos el término "
+    "independiente en ambos lados y luego dividimos por el coeficiente de x."
+)
+
+class FakeLatency:
+    def __init__(self, mean: float, jitter: float, seed: int = 0):
+        self.mean = mean
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+
+    async def wait(self):
+        delay = self.mean + self.rng.uniform(-self.jitter, self.jitter) if self.jitter else self.mean
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def usage(prompt_tokens: int, candidate_tokens: int):
+    return SimpleNamespace(prompt_token_count=prompt_tokens, candidates_token_count=candidate_tokens)
+
+def text_part(text: str):
+    return SimpleNamespace(text=text, function_call=None)
+
+def function_call_part(name: str, args: dict):
+    return SimpleNamespace(text="", function_call=SimpleNamespace(name=name, args=args))
+
+class FakeResponse:
+    def __init__(self, parts: list, prompt_tokens: int = 0):
+        self.parts = parts
+        self.usage_metadata = usage(prompt_tokens, sum(len(part.text) // 4 for part in parts))
+
+    @property
+    def text(self) -> str:
+        return "".join(part.text for part in self.parts)
+
+    @property
+    def candidates(self):
+        return [SimpleNamespace(content=SimpleNamespace(parts=self.parts))]
+
+class FakeStream(FakeResponse):
+    def __init__(self, parts: list, prompt_tokens: int, chunk_delay: float):
+        super().__init__(parts, prompt_tokens)
+        self.chunk_delay = chunk_delay
+
+    def __aiter__(self):
+        return self.chunks()
+
+    async def chunks(self):
+        for part in self.parts:
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+            yield FakeResponse([part])
+
+class FakeGenerativeModel:
+    def __init__(self, latency: FakeLatency, text: str):
+        self.latency = latency
+        self.text = text
+        self.calls = 0
+
+    async def generate_content_async(self, contents, **kwargs):
+        self.calls += 1
+        await self.latency.wait()
+        return FakeResponse([text_part(self.text)], prompt_tokens=258)
+
+class FakeChatSession:
+    def __init__(self, model: "FakeChatModel", history: list):
+        self.model = model
+        self.history = history
+
+    async def send_message_async(self, content, stream: bool = False, **kwargs):
+        self.model.calls += 1
+        await self.model.latency.wait()
+
+        prompt_tokens = sum(len(str(message)) // 4 for message in self.history) + len(str(content)) // 4
+        if isinstance(content, str) and self.model.tool_call:
+            parts = [function_call_part(*self.model.tool_call)]
+        else:
+            words = self.model.text.split(" ")
+            size = max(1, len(words) // self.model.chunks)
+            parts = [text_part(" ".join(words[i:i + size]) + " ") for i in range(0, len(words), size)]
+
+        if stream:
+            return FakeStream(parts, prompt_tokens, self.model.chunk_delay)
+        return FakeResponse(parts, prompt_tokens)
+
+class FakeChatModel:
+    def __init__(self, latency: FakeLatency, text: str, tool_call=None, chunks: int = 4, chunk_delay: float = 0.0):
+        self.latency = latency
+        self.text = text
+        self.tool_call = tool_call
+        self.chunks = chunks
+        self.chunk_delay = chunk_delay
+        self.calls = 0
+
+    def start_chat(self, history=None, **kwargs):
+        return FakeChatSession(self, history or [])
+
+def install(latency: float = 0.5, jitter: float = 0.0, analysis=None, chat_text: str = DEFAULT_CHAT_TEXT,
+            chat_tool_call=None, seed: int = 0) -> dict:
+    import core
+    import chat_agent
+
+    models = {
+        "core": FakeGenerativeModel(FakeLatency(latency, jitter, seed), json.dumps(analysis or DEFAULT_ANALYSIS)),
+        "chat_agent": FakeChatModel(FakeLatency(latency, jitter, seed + 1), chat_text, tool_call=chat_tool_call),
+        "summary": FakeGenerativeModel(FakeLatency(latency, jitter, seed + 2), "Resumen de la conversación."),
+    }
+    core.model = models["core"]
+    chat_agent.model = models["chat_agent"]
+    chat_agent.summary_model = models["summary"]
+    return models
@@ -0,0 +1,158 @@
+import time
+import json
+import asyncio
+import argparse
+from collections import Counter
+
+import offline
+from report import summarize, describe
+
+EMAIL = "carga@example.com"
+PASSWORD = "contraseña-de-carga"
+
+MCP_CALLS = [
+    ("resolver_ecuacion_lineal", {"m": 3, "b": -6}),
+    ("resolver_ecuacion_cuadratica", {"a": 1, "b": -5, "c": 6}),
+    ("realizar_operacion", {"expresion": "(3 + 4) * 2 - 5 / 2"}),
+]
+
+async def drive(name: str, send, total: int, concurrency: int) -> dict:
+    latencies, statuses = [], Counter()
+    next_index = 0
+
+    async def worker(worker_id: int):
+        nonlocal next_index
+        while next_index < total:
+            index = next_index
+            next_index += 1
+            start = time.perf_counter()
+            try:
+                status = await send(index, worker_id)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - start)
+            statuses[status] += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    return {
+        "scenario": name,
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 2) if elapsed else 0.0,
+        "statuses": {str(key): value for key, value in statuses.items()},
+        "latency": summarize(latencies),
+        "_latencies": latencies,
+    }
+
+async def drain_jobs(client, headers: dict, job_ids: list) -> tuple[float, dict]:
+    start = time.perf_counter()
+    pending, statuses = set(job_ids), Counter()
+    while pending:
+        await asyncio.sleep(0.05)
+        for job_id in list(pending):
+            job = (await client.get(f"/calculate/jobs/{job_id}", headers=headers)).json()
+            if job["status"] in ("done", "failed"):
+                statuses[job["status"]] += 1
+                pending.discard(job_id)
+    return round(time.perf_counter() - start, 3), dict(statuses)
+
+async def login(client) -> str:
+    await client.post("/register", json={"name": "Carga", "email": EMAIL, "password": PASSWORD})
+    response = await client.post("/token", data={"username": EMAIL, "password": PASSWORD})
+    return response.json()["access_token"]
+
+async def run(args) -> list[dict]:
+    tool_call = ("realizar_operacion", {"expresion": "2^10 + 3^4"}) if args.chat_tools else None
+    client, models = await offline.start_app(args.gemini_latency, args.gemini_jitter, chat_tool_call=tool_call)
+    try:
+        token = await login(client)
+        headers = {"Authorization": f"Bearer {token}"}
+        scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+        results = []
+
+        for scenario in scenarios:
+            if scenario == "token":
+                async def send(index, worker_id):
+                    response = await client.post("/token", data={"username": EMAIL, "password": PASSWORD})
+                    return response.status_code
+            elif scenario == "calculate":
+                images = [offline.whiteboard(args.seed + i) for i in range(args.requests)]
+
+                async def send(index, worker_id):
+                    response = await client.post("/calculate", json={"image": images[index]}, headers=headers)
+                    return response.status_code
+            elif scenario == "jobs":
+                # Mide cuánto tarda en aceptarse cada trabajo; la espera hasta que
+                # la cola se vacía se informa aparte.
+                images = [offline.whiteboard(args.seed + 10_000 + i) for i in range(args.requests)]
+                job_ids = []
+
+                async def send(index, worker_id):
+                    response = await client.post("/calculate/jobs", json={"image": images[index]}, headers=headers)
+                    if response.status_code == 202:
+                        job_ids.append(response.json()["job_id"])
+                    return response.status_code
+            elif scenario == "chat":
+                conversations = []
+                for _ in range(args.concurrency):
+                    response = await client.post("/conversations/new", headers=headers)
+                    conversations.append(response.json()["conversation_id"])
+
+                async def send(index, worker_id):
+                    response = await client.post("/chat", json={
+                        "message": f"¿Me explicas cómo se despeja la x? (pregunta {index})",
+                        "conversation_id": conversations[worker_id]
+                    }, headers=headers)
+                    return response.status_code
+            elif scenario == "mcp":
+                async def send(index, worker_id):
+                    name, arguments = MCP_CALLS[index % len(MCP_CALLS)]
+                    response = await client.post("/mcp", json={
+                        "jsonrpc": "2.0", "id": index, "method": "tools/call",
+                        "params": {"name": name, "arguments": arguments}
+                    })
+                    return response.status_code
+            else:
+                raise SystemExit(f"Escenario desconocido: {scenario}")
+
+            result = await drive(scenario, send, args.requests, args.concurrency)
+            if scenario == "jobs":
+                result["drain_seconds"], result["job_statuses"] = await drain_jobs(client, headers, job_ids)
+            result["gemini_calls"] = {component: model.calls for component, model in models.items()}
+            results.append(result)
+            print(
+                f"{scenario:<10} {result['throughput_rps']:>8.1f} req/s  {describe(result.pop('_latencies'))}  "
+                f"códigos={result['statuses']}"
+            )
+            if scenario == "jobs":
+                print(f"{'':<10} cola vaciada en {result['drain_seconds']:.2f} s  trabajos={result['job_statuses']}")
+        return results
+    finally:
+        await client.aclose()
+        await offline.stop_app()
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga sin red con Gemini y MongoDB simulados")
+    parser.add_argument("--scenarios", default="token,calculate,jobs,chat,mcp", help="lista separada por comas")
+    parser.add_argument("--requests", type=int, default=200, help="peticiones por escenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--gemini-latency", type=float, default=0.5, help="segundos por llamada simulada a Gemini")
+    parser.add_argument("--gemini-jitter", type=float, default=0.1)
+    parser.add_argument("--chat-tools", action="store_true", help="el chat simulado pide una herramienta antes de responder")
+    parser.add_argument("--bcrypt-rounds", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="guardar los resultados en este archivo")
+    args = parser.parse_args()
+
+    overrides = {"BCRYPT_ROUNDS": args.bcrypt_rounds} if args.bcrypt_rounds else {}
+    offline.prepare_environment(**overrides)
+    results = asyncio.run(run(args))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(results, output, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
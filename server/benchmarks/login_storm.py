@@ -0,0 +1,81 @@
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+import httpx
+
+from report import describe
+
+PASSWORD = "contraseña-de-prueba"
+
+async def register_students(client: httpx.AsyncClient, students: int, prefix: str) -> Counter:
+    # Se registran de a uno para que la preparación no sea otra ráfaga; 400 indica
+    # que el estudiante ya existía de una corrida anterior.
+    statuses = Counter()
+    for i in range(students):
+        response = await client.post("/register", json={
+            "name": f"Estudiante {i}",
+            "email": f"{prefix}{i}@example.com",
+            "password": PASSWORD
+        })
+        statuses[response.status_code] += 1
+    return statuses
+
+async def login(client: httpx.AsyncClient, email: str, latencies: list, statuses: Counter):
+    start = time.perf_counter()
+    response = await client.post("/token", data={"username": email, "password": PASSWORD})
+    latencies.append(time.perf_counter() - start)
+    statuses[response.status_code] += 1
+
+async def probe(client: httpx.AsyncClient, path: str, interval: float, stop: asyncio.Event, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await client.get(path)
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(interval)
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.students + 10)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=60, limits=limits) as client:
+        print(f"Registrando {args.students} estudiantes...")
+        registered = await register_students(client, args.students, args.prefix)
+        print(f"Registro: {dict(registered)}")
+
+        idle = []
+        stop = asyncio.Event()
+        idle_probe = asyncio.create_task(probe(client, args.probe_path, args.probe_interval, stop, idle))
+        await asyncio.sleep(1)
+        stop.set()
+        await idle_probe
+
+        login_latencies, probe_latencies, statuses = [], [], Counter()
+        stop = asyncio.Event()
+        storm_probe = asyncio.create_task(probe(client, args.probe_path, args.probe_interval, stop, probe_latencies))
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            login(client, f"{args.prefix}{i % args.students}@example.com", login_latencies, statuses)
+            for i in range(args.logins or args.students)
+        ])
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await storm_probe
+
+    print(f"Logins: {sum(statuses.values())} en {elapsed:.2f} s ({sum(statuses.values()) / elapsed:.1f} por segundo)")
+    print(f"Códigos de respuesta: {dict(statuses)}")
+    print(f"Latencia de login: {describe(login_latencies)}")
+    print(f"GET {args.probe_path} en reposo: {describe(idle)}")
+    print(f"GET {args.probe_path} durante la ráfaga: {describe(probe_latencies)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Ráfaga de logins simultáneos contra un servidor en marcha")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--students", type=int, default=40)
+    parser.add_argument("--logins", type=int, default=0, help="logins a enviar (por defecto uno por estudiante)")
+    parser.add_argument("--prefix", default="bench-login-")
+    parser.add_argument("--probe-path", default="/")
+    parser.add_argument("--probe-interval", type=float, default=0.02)
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import base64
+import timeit
+import argparse
+import platform
+
+import offline
+
+BASELINES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+
+def build_cases() -> dict:
+    from mcp_tools import (
+        resolver_ecuacion_lineal, resolver_ecuacion_cuadratica, realizar_operacion,
+        tabla_de_valores, resolver_lote_lineal, resolver_lote_cuadratico
+    )
+    from expression_engine import compile_expression
+    from image_preprocessing import preprocess_image
+    from analysis_cache import analysis_cache_key
+    from board_regions import split_board
+    from fast_path import try_fast_answer
+
+    board = offline.whiteboard(seed=1, strokes=6)
+    board_bytes = base64.b64decode(board.split(",")[-1])
+    processed = preprocess_image(board_bytes)
+    coefficients = [float(i % 17 + 1) for i in range(1000)]
+    offsets = [float(i % 23 - 11) for i in range(1000)]
+
+    return {
+        "resolver_ecuacion_lineal": lambda: resolver_ecuacion_lineal(3, -6),
+        "resolver_ecuacion_cuadratica": lambda: resolver_ecuacion_cuadratica(1, -5, 6),
+        "realizar_operacion": lambda: realizar_operacion("(3 + 4) * 2 - 5 / 2"),
+        "compilar_expresion_sin_cache": lambda: compile_expression.__wrapped__("3x^2 - 2(x + 1) / sqrt(4)"),
+        "tabla_de_valores_41": lambda: tabla_de_valores("x^2 - 3x + 2", -10, 10, 0.5),
+        "resolver_lote_lineal_1000": lambda: resolver_lote_lineal(coefficients, offsets),
+        "resolver_lote_cuadratico_1000": lambda: resolver_lote_cuadratico(coefficients, offsets, offsets),
+        "ruta_rapida_ecuacion": lambda: try_fast_answer("resuelve 2x + 3 = 7"),
+        "decodificar_pizarra_base64": lambda: base64.b64decode(board.split(",")[-1]),
+        "preprocesar_pizarra": lambda: preprocess_image(board_bytes),
+        "dividir_pizarra_renglones": lambda: split_board(board_bytes),
+        "clave_cache_analisis": lambda: analysis_cache_key(processed, {"x": 2}),
+    }
+
+def measure(func, repeat: int) -> float:
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number * 1e6
+
+def load_baselines() -> dict:
+    if not os.path.exists(BASELINES_PATH):
+        return {}
+    with open(BASELINES_PATH, encoding="utf-8") as source:
+        return json.load(source)
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks de las herramientas y del preprocesado de pizarras")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--filter", default="", help="sólo los casos que contengan este texto")
+    parser.add_argument("--save", action="store_true", help="guardar los resultados como nueva línea base")
+    parser.add_argument("--threshold", type=float, default=0.25, help="empeoramiento tolerado respecto a la línea base")
+    parser.add_argument("--check", action="store_true", help="salir con código 1 si hay regresiones")
+    args = parser.parse_args()
+
+    offline.prepare_environment()
+    baselines = load_baselines().get("cases", {})
+    results = {}
+    regressions = []
+
+    print(f"{'caso':<32} {'µs/op':>12} {'base':>12} {'cambio':>8}")
+    for name, func in build_cases().items():
+        if args.filter not in name:
+            continue
+        microseconds = measure(func, args.repeat)
+        results[name] = round(microseconds, 3)
+        baseline = baselines.get(name)
+        change = ""
+        if baseline:
+            ratio = microseconds / baseline - 1
+            change = f"{ratio:+.0%}"
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += " !"
+        print(f"{name:<32} {microseconds:>12.2f} {baseline or '-':>12} {change:>8}")
+
+    if args.save:
+        with open(BASELINES_PATH, "w", encoding="utf-8") as output:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cases": {**baselines, **results},
+            }, output, indent=2, ensure_ascii=False)
+            output.write("\n")
+        print(f"Línea base guardada en {BASELINES_PATH}")
+
+    if regressions:
+        print(f"Regresiones mayores al {args.threshold:.0%}: {', '.join(regressions)}")
+        if args.check:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import os
+import sys
+import io
+import base64
+import random
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+# Servidor completo en el mismo proceso, sin red: Gemini se reemplaza por
+# fake_gemini y MongoDB por mongomock_motor (ver benchmarks/requirements.txt).
+
+def prepare_environment(**overrides):
+    defaults = {
+        "GEMINI_API_KEY": "offline",
+        "SECRET_KEY": "offline-benchmark",
+        "MONGO_URI": "mongodb://localhost/benchmark",
+    }
+    for name, value in {**defaults, **overrides}.items():
+        os.environ.setdefault(name, str(value))
+
+    import logging
+    logging.disable(logging.INFO)
+
+    from mongomock_motor import AsyncMongoMockClient
+    import database
+    database.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
+
+async def start_app(latency: float, jitter: float = 0.0, chat_tool_call=None):
+    import httpx
+    import main
+    import fake_gemini
+    from database import init_db
+
+    # Los print por petición de main.py ensuciarían el reporte.
+    main.print = lambda *args, **kwargs: None
+    await init_db()
+    main.warm_up_exercises()
+    await main.tool_executor.warm_up()
+    await main.job_queue.start(main.run_whiteboard_job)
+    models = fake_gemini.install(latency=latency, jitter=jitter, chat_tool_call=chat_tool_call)
+    transport = httpx.ASGITransport(app=main.app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://offline", timeout=120)
+    return client, models
+
+async def stop_app():
+    from tool_executor import tool_executor
+    from calculation_jobs import job_queue
+    await job_queue.stop()
+    tool_executor.shutdown()
+
+def whiteboard(seed: int, strokes: int = 3, size: tuple = (800, 600)) -> str:
+    # Cada semilla dibuja trazos distintos para no acertar siempre en la caché de análisis.
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(image)
+    for _ in range(strokes):
+        x, y = rng.randint(50, size[0] - 250), rng.randint(50, size[1] - 100)
+        draw.line((x, y, x + rng.randint(60, 200), y + rng.randint(-40, 40)), fill=(0, 0, 0, 255), width=4)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
@@ -0,0 +1,29 @@
+import statistics
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+def summarize(values: list[float]) -> dict:
+    ms = [value * 1000 for value in values]
+    if not ms:
+        return {"n": 0}
+    return {
+        "n": len(ms),
+        "p50_ms": round(percentile(ms, 0.5), 2),
+        "p95_ms": round(percentile(ms, 0.95), 2),
+        "p99_ms": round(percentile(ms, 0.99), 2),
+        "max_ms": round(max(ms), 2),
+        "mean_ms": round(statistics.mean(ms), 2),
+    }
+
+def describe(values: list[float]) -> str:
+    summary = summarize(values)
+    if not summary["n"]:
+        return "sin datos"
+    return (
+        f"n={summary['n']} p50={summary['p50_ms']:.1f} ms p95={summary['p95_ms']:.1f} ms "
+        f"p99={summary['p99_ms']:.1f} ms max={summary['max_ms']:.1f} ms media={summary['mean_ms']:.1f} ms"
+    )
@@ -0,0 +1,105 @@
+import os
+import io
+import json
+import hashlib
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+from cache import CountingCache
+from image_preprocessing import normalize_image, ink_mask, preprocessing_stats
+
+BOARD_INCREMENTAL = os.getenv("BOARD_INCREMENTAL", "true").lower() in ("1", "true", "yes")
+BOARD_LINE_GAP = int(os.getenv("BOARD_LINE_GAP", "24"))
+BOARD_STATE_CACHE_SIZE = int(os.getenv("BOARD_STATE_CACHE_SIZE", "1024"))
+BOARD_STATE_TTL = int(os.getenv("BOARD_STATE_TTL", "3600"))
+
+# Último análisis de la pizarra de cada conversación, por renglones:
+# {"vars": huella de dict_of_vars, "segments": [{"regions": [hash, ...], "results": [...]}]}
+board_states = CountingCache(maxsize=BOARD_STATE_CACHE_SIZE, ttl=BOARD_STATE_TTL)
+
+incremental_stats = {
+    "boards": 0,
+    "regions_reused": 0,
+    "regions_analyzed": 0,
+    "model_calls_skipped": 0,
+}
+
+def board_state_key(owner_id, conversation_id: str) -> tuple:
+    return (str(owner_id), conversation_id)
+
+def vars_fingerprint(dict_of_vars: dict) -> str:
+    encoded = json.dumps(dict_of_vars, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+def line_bands(mask: Image.Image) -> list[tuple[int, int]]:
+    # Renglones de tinta separados por al menos BOARD_LINE_GAP filas en blanco.
+    rows = np.flatnonzero(np.asarray(mask).any(axis=1))
+    if rows.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(rows) > BOARD_LINE_GAP)
+    starts = np.concatenate(([rows[0]], rows[breaks + 1]))
+    ends = np.concatenate((rows[breaks], [rows[-1]]))
+    return [(int(top), int(bottom) + 1) for top, bottom in zip(starts, ends)]
+
+def region_hash(mask: Image.Image, top: int, bottom: int) -> str:
+    # Sólo cuenta el trazo, no su posición: un renglón que no cambió da el mismo hash.
+    band = mask.crop((0, top, mask.width, bottom))
+    band = band.crop(band.getbbox())
+    digest = hashlib.sha256(f"{band.width}x{band.height}".encode())
+    digest.update(band.tobytes())
+    return digest.hexdigest()
+
+def split_board(image_data: bytes) -> tuple[Image.Image, list[dict]]:
+    preprocessing_stats["requests"] += 1
+    preprocessing_stats["bytes_in"] += len(image_data)
+
+    gray = normalize_image(Image.open(io.BytesIO(image_data)))
+    mask = ink_mask(gray)
+    regions = [
+        {"top": top, "bottom": bottom, "hash": region_hash(mask, top, bottom)}
+        for top, bottom in line_bands(mask)
+    ]
+    if not regions:
+        preprocessing_stats["blank_skipped"] += 1
+    return gray, regions
+
+def reusable_segments(state: Optional[dict], regions: list[dict], vars_key: str) -> tuple[list[dict], int]:
+    # Se reutilizan los segmentos previos que coinciden completos y en orden desde
+    # arriba; desde el primer cambio se vuelve a analizar todo lo que sigue, porque
+    # un renglón puede usar variables asignadas en los anteriores.
+    if not state or state["vars"] != vars_key:
+        return [], 0
+
+    hashes = [region["hash"] for region in regions]
+    segments, start = [], 0
+    for segment in state["segments"]:
+        end = start + len(segment["regions"])
+        if hashes[start:end] != segment["regions"]:
+            break
+        segments.append(segment)
+        start = end
+    return segments, start
+
+def region_strip(gray: Image.Image, regions: list[dict]) -> Image.Image:
+    margin = BOARD_LINE_GAP // 2
+    return gray.crop((
+        0,
+        max(regions[0]["top"] - margin, 0),
+        gray.width,
+        min(regions[-1]["bottom"] + margin, gray.height)
+    ))
+
+def assigned_vars(results: list) -> dict:
+    return {
+        str(item["expr"]): item["result"]
+        for item in results
+        if isinstance(item, dict) and item.get("assign") and "expr" in item
+    }
+
+def has_errors(results: list) -> bool:
+    return any(isinstance(item, dict) and item.get("expr") == "error" for item in results)
+
+def board_state_stats() -> dict:
+    return {**board_states.stats(), **incremental_stats, "enabled": BOARD_INCREMENTAL}
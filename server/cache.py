@@ -0,0 +1,43 @@
+import time
+from cachetools import TTLCache
+
+_MISSING = object()
+
+class CountingCache:
+    def __init__(self, maxsize: int, ttl: float, timer=time.monotonic):
+        self._data = TTLCache(maxsize=maxsize, ttl=ttl, timer=timer)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        value = self._data.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self._data[key] = value
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self._data.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,243 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+
+from concurrency import ServiceBusyError
+from conversation_store import owner_key
+from image_store import delete_unreferenced_images
+from models import CalculationJob, CalculationJobRead, utc_now
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY = float(os.getenv("JOB_RETRY_DELAY", "2"))
+JOB_TIMEOUT = float(os.getenv("JOB_TIMEOUT", "120"))
+JOB_MAX_QUEUE = int(os.getenv("JOB_MAX_QUEUE", "1000"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "86400"))
+
+FINISHED = ("done", "failed")
+
+class JobFailed(Exception):
+    # Error definitivo: el trabajo no se reintenta.
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def job_filter(job_id: str, owner_id: Optional[object] = None) -> Optional[dict]:
+    try:
+        query = {"_id": ObjectId(job_id)}
+    except (InvalidId, TypeError):
+        return None
+    if owner_id is not None:
+        query["owner_id"] = owner_key(owner_id)
+    return query
+
+def job_read(job: CalculationJob) -> CalculationJobRead:
+    return CalculationJobRead(job_id=str(job.id), **job.model_dump(include=set(CalculationJobRead.model_fields)))
+
+# Los trabajos viven en MongoDB: cualquier proceso los puede tomar y sobreviven a
+# un reinicio. Los workers son tareas del event loop de este proceso; el handler
+# (el mismo flujo de /calculate) lo registra main.py al iniciar.
+class JobQueue:
+    def __init__(self, workers: int, max_attempts: int, retry_delay: float, timeout: float, max_queue: int):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.handler = None
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup = asyncio.Event()
+        self._waiters: dict[str, list[asyncio.Future]] = {}
+        self.queued = 0
+        self.running = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.rejected = 0
+
+    def collection(self):
+        return CalculationJob.get_pymongo_collection()
+
+    async def start(self, handler):
+        self.handler = handler
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self.worker()) for _ in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self.monitor()))
+        print(f"Cola de cálculos lista con {self.workers} worker(s)")
+
+    async def stop(self):
+        # Los trabajos interrumpidos quedan "running" y monitor() los reencola
+        # cuando superan JOB_TIMEOUT.
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def submit(self, job: CalculationJob) -> CalculationJob:
+        self.queued = await self.collection().count_documents({"status": "queued"})
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise ServiceBusyError("Cola de cálculos llena, intenta de nuevo en unos segundos")
+
+        job.max_attempts = self.max_attempts
+        await job.insert()
+        self.submitted += 1
+        self.queued += 1
+        self._wakeup.set()
+        return job
+
+    async def get(self, job_id: str, owner_id) -> Optional[CalculationJob]:
+        query = job_filter(job_id, owner_id)
+        if query is None:
+            return None
+        document = await self.collection().find_one(query)
+        return CalculationJob.model_validate(document) if document else None
+
+    async def claim(self) -> Optional[CalculationJob]:
+        now = utc_now()
+        document = await self.collection().find_one_and_update(
+            {"status": "queued", "available_at": {"$lte": now}},
+            {"$set": {"status": "running", "started_at": now}, "$inc": {"attempts": 1}},
+            sort=[("priority", DESCENDING), ("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+        return CalculationJob.model_validate(document) if document else None
+
+    async def worker(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                job = await self.claim()
+            except Exception as e:
+                logging.warning(f"No se pudo leer la cola de cálculos: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=JOB_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.process(job)
+
+    async def process(self, job: CalculationJob):
+        self.queued = max(self.queued - 1, 0)
+        self.running += 1
+        try:
+            result = await asyncio.wait_for(self.handler(job), timeout=self.timeout)
+        except JobFailed as e:
+            await self.finish(job, "failed", error={"status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                error = {"status": 504, "detail": f"El análisis superó el tiempo máximo de {self.timeout:g} s"}
+            elif isinstance(e, ServiceBusyError):
+                error = {"status": 503, "detail": str(e)}
+            else:
+                error = {"status": 500, "detail": str(e)}
+            await self.retry_or_fail(job, error)
+        else:
+            await self.finish(job, "done", result=result)
+        finally:
+            self.running -= 1
+
+    def attempt_filter(self, job: CalculationJob) -> dict:
+        # Sólo el intento vigente cambia el trabajo: si requeue_stale lo reencoló
+        # y otro worker lo tomó, el intento anterior ya no lo finaliza.
+        return {"_id": job.id, "status": "running", "attempts": job.attempts}
+
+    async def retry_or_fail(self, job: CalculationJob, error: dict):
+        if job.attempts >= job.max_attempts:
+            logging.warning(f"Trabajo {job.id} falló tras {job.attempts} intento(s): {error['detail']}")
+            await self.finish(job, "failed", error=error)
+            return
+
+        delay = self.retry_delay * 2 ** (job.attempts - 1)
+        result = await self.collection().update_one(
+            self.attempt_filter(job),
+            {"$set": {"status": "queued", "available_at": utc_now() + timedelta(seconds=delay), "error": error}}
+        )
+        if result.modified_count:
+            self.retried += 1
+            self.queued += 1
+        self.notify(str(job.id))
+
+    async def finish(self, job: CalculationJob, status: str, result: Optional[dict] = None, error: Optional[dict] = None):
+        now = utc_now()
+        update = await self.collection().update_one(self.attempt_filter(job), {"$set": {
+            "status": status,
+            "result": result,
+            "error": error,
+            "finished_at": now,
+            "expires_at": now + timedelta(seconds=JOB_RESULT_TTL),
+        }})
+        if not update.modified_count:
+            logging.warning(f"Trabajo {job.id}: el intento {job.attempts} ya no es el vigente, se descarta su resultado")
+        elif status == "done":
+            self.completed += 1
+        else:
+            self.failed += 1
+            # Ninguna conversación usa la imagen de un trabajo fallido.
+            await delete_unreferenced_images({job.image_id})
+        self.notify(str(job.id))
+
+    async def requeue_stale(self):
+        cutoff = utc_now() - timedelta(seconds=self.timeout * 2)
+        async for document in self.collection().find({"status": "running", "started_at": {"$lt": cutoff}}):
+            job = CalculationJob.model_validate(document)
+            await self.retry_or_fail(job, {"status": 500, "detail": "El proceso que ejecutaba el trabajo se detuvo"})
+
+    async def monitor(self):
+        while True:
+            try:
+                await self.requeue_stale()
+                self.queued = await self.collection().count_documents({"status": "queued"})
+            except Exception as e:
+                logging.warning(f"No se pudo revisar la cola de cálculos: {e}")
+            await asyncio.sleep(max(JOB_POLL_INTERVAL, 1) * 5)
+
+    def notify(self, job_id: str):
+        for waiter in self._waiters.pop(job_id, []):
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def wait(self, job_id: str, timeout: float):
+        # Despierta cuando este proceso cambia el estado del trabajo; si lo
+        # procesa otro, quien espera vuelve a leer MongoDB tras `timeout`.
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(job_id, []).append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(job_id)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del self._waiters[job_id]
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": self.running,
+            "max_queue": self.max_queue,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retried": self.retried,
+            "rejected": self.rejected,
+        }
+
+job_queue = JobQueue(JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY, JOB_TIMEOUT, JOB_MAX_QUEUE)
@@ -2,8 +2,16 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
+import time
+import asyncio
+from collections.abc import Iterable, Mapping
 import google.generativeai as genai
 from mcp_tools import TOOLS_FUNCTIONS, TOOLS_METADATA
+from concurrency import llm_gate, chat_flight, request_fingerprint, ServiceBusyError
+from fast_path import try_fast_answer
+from answer_cache import answer_cache, answer_cache_key
+from tool_executor import tool_executor
+from metrics import timed_gemini, gemini_duration, gemini_requests, record_usage
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
@@ -11,6 +19,9 @@ if not GEMINI_API_KEY:
 
 genai.configure(api_key=GEMINI_API_KEY)
 
+CHAT_MAX_TOOL_ROUNDS = int(os.getenv("CHAT_MAX_TOOL_ROUNDS", "5"))
+CHAT_FAST_PATH = os.getenv("CHAT_FAST_PATH", "true").lower() in ("1", "true", "yes")
+
 gemini_tools = []
 for tool_name, metadata in TOOLS_METADATA.items():
     gemini_tools.append({
@@ -27,11 +38,15 @@ Tienes la capacidad de ver capturas de pantalla de una pizarra donde el usuario
 Puedes proponer actividades prácticas para que el estudiante refuerce su aprendizaje que deban ser contestadas en la pizarra con ejercicios.
 Puedes proponer soluciones paso a paso y explicar conceptos matemáticos de manera clara y sencilla.}
 Se proactivo y siempre intenta dar ejercicios para que el estudiante practique en la pizarra.
+Para proponer ejercicios usa la herramienta generar_ejercicio, que ya trae la solución verificada; no inventes ejercicios por tu cuenta.
 
 TUS CAPACIDADES:
 - resolver_ecuacion_lineal(m, b): Para ecuaciones de la forma mx + b = 0
 - resolver_ecuacion_cuadratica(a, b, c): Para ecuaciones de la forma ax² + bx + c = 0
 - realizar_operacion(expresion): Para evaluar operaciones matemáticas
+- tabla_de_valores(expresion, desde, hasta, paso, variable): Para armar tablas de valores de una función
+- resolver_lote_lineal(m, b) y resolver_lote_cuadratico(a, b, c): Para resolver o verificar muchas ecuaciones de una sola vez
+- generar_ejercicio(tema, dificultad): Para obtener un ejercicio de práctica lineal o cuadrático con su solución
 
 REGLAS ESTRICTAS:
 1. SOLO MATEMÁTICAS: Si el usuario pregunta sobre cualquier tema que NO sea matemáticas, responde:
@@ -52,6 +67,21 @@ model = genai.GenerativeModel(
     tools=gemini_tools
 )
 
+summary_model = genai.GenerativeModel('gemini-2.5-flash')
+
+SUMMARY_PROMPT = """
+Resume la siguiente conversación entre un estudiante y su tutor de matemáticas en español, en no más de 150 palabras.
+Conserva los ejercicios planteados, los resultados obtenidos y las dudas pendientes del estudiante.
+"""
+
+async def summarize_conversation(previous_summary: str, messages: list[dict]) -> str:
+    transcript = "\n".join(
+        f"{'Estudiante' if msg['sender'] == 'user' else 'Tutor'}: {msg['text']}" for msg in messages
+    )
+    prompt = f"{SUMMARY_PROMPT}\nResumen previo: {previous_summary or '(ninguno)'}\n\nConversación nueva:\n{transcript}"
+    response = await llm_gate.run(timed_gemini, "summary", summary_model.generate_content_async, prompt)
+    return response.text.strip()
+
 def format_chat_history(history: list[dict]) -> list:
     gemini_history = []
     for msg in history:
@@ -62,42 +92,159 @@ def format_chat_history(history: list[dict]) -> list:
         })
     return gemini_history
 
-async def get_tutor_response(user_message: str, history: list[dict]) -> str:
+async def execute_tool(tool_name: str, tool_args: dict) -> dict:
+    if tool_name not in TOOLS_FUNCTIONS:
+        return {"error": f"Herramienta '{tool_name}' no reconocida"}
+    try:
+        return await tool_executor.run(tool_name, tool_args)
+    except Exception as e:
+        return {"error": f"Error ejecutando {tool_name}: {str(e)}"}
+
+def plain_value(value):
+    # Gemini entrega los argumentos como MapComposite/RepeatedComposite de proto;
+    # se pasan a dict/list para poder enviarlos al pool de procesos y a JSON.
+    if isinstance(value, (str, bytes)):
+        return value
+    if isinstance(value, Mapping):
+        return {key: plain_value(item) for key, item in value.items()}
+    if isinstance(value, Iterable):
+        return [plain_value(item) for item in value]
+    return value
+
+def extract_function_calls(parts) -> list[tuple[str, dict]]:
+    return [
+        (part.function_call.name, plain_value(part.function_call.args) if part.function_call.args else {})
+        for part in parts
+        if getattr(part, 'function_call', None)
+    ]
+
+def response_parts(response) -> list:
+    if response.candidates and response.candidates[0].content.parts:
+        return list(response.candidates[0].content.parts)
+    return []
+
+async def run_tool_calls(function_calls: list[tuple[str, dict]]) -> list[dict]:
+    return await asyncio.gather(*[
+        execute_tool(tool_name, tool_args)
+        for tool_name, tool_args in function_calls
+    ])
+
+def function_responses(function_calls: list[tuple[str, dict]], results: list[dict]) -> list[dict]:
+    return [
+        {"function_response": {"name": tool_name, "response": result}}
+        for (tool_name, _), result in zip(function_calls, results)
+    ]
+
+INCOMPLETE_RESPONSE = "Lo siento, no pude completar la respuesta con mis herramientas. ¿Puedes reformular la pregunta?"
+
+async def get_tutor_response(user_message: str, history: list[dict], bypass_cache: bool = False) -> str:
+    if CHAT_FAST_PATH:
+        fast_answer = try_fast_answer(user_message)
+        if fast_answer:
+            return fast_answer
+
+    # Con bypass_cache no se lee la caché, pero la respuesta nueva la reemplaza.
+    cache_key = answer_cache_key(user_message, history)
+    if cache_key and not bypass_cache:
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    # El mismo mensaje con el mismo historial en curso (doble clic, reintentos,
+    # varias pestañas) espera la respuesta de la primera petición.
+    key = request_fingerprint(" ".join(user_message.split()), history)
+    text, cacheable = await chat_flight.run(key, request_tutor_response, user_message, history)
+    if cache_key and cacheable:
+        answer_cache.set(cache_key, text)
+    return text
+
+async def request_tutor_response(user_message: str, history: list[dict]) -> tuple[str, bool]:
+    # Devuelve también si la respuesta se puede guardar en la caché: sólo las
+    # que salen completas de Gemini sin usar herramientas.
     try:
         chat_history = format_chat_history(history)
         chat = model.start_chat(history=chat_history)
-        response = chat.send_message(user_message)
-
-        if response.candidates and response.candidates[0].content.parts:
-            for part in response.candidates[0].content.parts:
-                if hasattr(part, 'function_call') and part.function_call:
-                    function_call = part.function_call
-                    tool_name = function_call.name
-                    tool_args = {}
-
-                    if hasattr(function_call, 'args'):
-                        tool_args = dict(function_call.args)
-
-                    if tool_name not in TOOLS_FUNCTIONS:
-                        function_response_content = {"error": f"Herramienta '{tool_name}' no reconocida"}
-                    else:
-                        try:
-                            tool_function = TOOLS_FUNCTIONS[tool_name]
-                            tool_result = tool_function(**tool_args)
-                            function_response_content = tool_result
-                        except Exception as e:
-                            function_response_content = {"error": f"Error ejecutando {tool_name}: {str(e)}"}
-
-                    response = chat.send_message({
-                        "function_response": {
-                            "name": tool_name,
-                            "response": function_response_content
-                        }
-                    })
-
-        result = response.text
-        return result
-
+        response = await llm_gate.run(timed_gemini, "chat_agent", chat.send_message_async, user_message)
+
+        used_tools = False
+        for _ in range(CHAT_MAX_TOOL_ROUNDS):
+            function_calls = extract_function_calls(response_parts(response))
+            if not function_calls:
+                break
+            used_tools = True
+            results = await run_tool_calls(function_calls)
+            response = await llm_gate.run(
+                timed_gemini, "chat_agent", chat.send_message_async, function_responses(function_calls, results)
+            )
+
+        text = "".join(part.text for part in response_parts(response) if getattr(part, 'text', None))
+        return text or INCOMPLETE_RESPONSE, bool(text) and not used_tools
+
+    except ServiceBusyError:
+        raise
     except Exception as e:
         print(f"Error en get_tutor_response: {e}")
-        return f"Lo siento, tuve un error interno. Intenta de nuevo. (Error: {str(e)})"
\ No newline at end of file
+        return f"Lo siento, tuve un error interno. Intenta de nuevo. (Error: {str(e)})", False
+
+async def stream_chat_message(chat, content, parts: list):
+    async with llm_gate.slot():
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await chat.send_message_async(content, stream=True)
+            async for chunk in response:
+                if not chunk.candidates or not chunk.candidates[0].content.parts:
+                    continue
+                for part in chunk.candidates[0].content.parts:
+                    parts.append(part)
+                    if part.text:
+                        yield part.text
+            outcome = "ok"
+            record_usage("chat_agent", response)
+        finally:
+            gemini_duration.observe(time.perf_counter() - start, component="chat_agent")
+            gemini_requests.inc(component="chat_agent", outcome=outcome)
+
+async def stream_tutor_response(user_message: str, history: list[dict], bypass_cache: bool = False):
+    if CHAT_FAST_PATH:
+        fast_answer = try_fast_answer(user_message)
+        if fast_answer:
+            yield "token", {"text": fast_answer}
+            yield "done", {"text": fast_answer}
+            return
+
+    cache_key = answer_cache_key(user_message, history)
+    if cache_key and not bypass_cache:
+        cached = answer_cache.get(cache_key)
+        if cached is not None:
+            yield "token", {"text": cached}
+            yield "done", {"text": cached}
+            return
+
+    chat_history = format_chat_history(history)
+    chat = model.start_chat(history=chat_history)
+    full_text = []
+    content = user_message
+    rounds = 0
+
+    while True:
+        parts = []
+        async for text in stream_chat_message(chat, content, parts):
+            full_text.append(text)
+            yield "token", {"text": text}
+
+        function_calls = extract_function_calls(parts)
+        if not function_calls or rounds == CHAT_MAX_TOOL_ROUNDS:
+            break
+        rounds += 1
+        for tool_name, tool_args in function_calls:
+            yield "tool_call", {"name": tool_name, "args": tool_args}
+        results = await run_tool_calls(function_calls)
+        for (tool_name, _), result in zip(function_calls, results):
+            yield "tool_result", {"name": tool_name, "result": result}
+        content = function_responses(function_calls, results)
+
+    text = "".join(full_text)
+    if cache_key and text and rounds == 0 and not function_calls:
+        answer_cache.set(cache_key, text)
+    yield "done", {"text": text or INCOMPLETE_RESPONSE}
@@ -0,0 +1,89 @@
+import os
+import json
+import logging
+from typing import List, Optional
+from uuid import UUID
+
+from models import Conversation
+from conversation_store import owned_filter
+from chat_agent import summarize_conversation
+
+CHAT_CONTEXT_TOKEN_BUDGET = int(os.getenv("CHAT_CONTEXT_TOKEN_BUDGET", "3000"))
+CHAT_CONTEXT_MAX_MESSAGES = int(os.getenv("CHAT_CONTEXT_MAX_MESSAGES", "60"))
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def message_text(message: dict) -> str:
+    text = message.get("text", "")
+    if message.get("analysis_result"):
+        text = f"{text} {json.dumps(message['analysis_result'], ensure_ascii=False)}"
+    return text
+
+def split_by_budget(messages: List[dict], budget: int) -> int:
+    used = 0
+    for index in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(message_text(messages[index]))
+        if used > budget:
+            return index + 1
+    return 0
+
+async def read_messages(collection, query: dict, start: int, end: int) -> List[dict]:
+    if end <= start:
+        return []
+    document = await collection.find_one(query, {"messages": {"$slice": [start, end - start]}})
+    return (document or {}).get("messages", [])
+
+async def build_chat_history(conversation_id: str, owner_id: UUID) -> Optional[List[dict]]:
+    query = owned_filter(conversation_id, owner_id)
+    if query is None:
+        return None
+    collection = Conversation.get_pymongo_collection()
+
+    meta = await collection.find_one(query, {"summary": 1, "summary_upto": 1, "message_count": 1})
+    if meta is None:
+        return None
+
+    summary = meta.get("summary", "")
+    summary_upto = meta.get("summary_upto", 0)
+    total = meta.get("message_count", 0)
+
+    async def fold(older: List[dict], upto: int):
+        # Agrega `older` al resumen; sólo se guarda si nadie más lo avanzó mientras tanto.
+        nonlocal summary, summary_upto
+        new_summary = await summarize_conversation(summary, [
+            {"sender": m.get("sender", "user"), "text": message_text(m)} for m in older
+        ])
+        await collection.update_one(
+            {**query, "summary_upto": summary_upto},
+            {"$set": {"summary": new_summary, "summary_upto": upto}}
+        )
+        summary, summary_upto = new_summary, upto
+
+    try:
+        # Lo que quedó fuera de la ventana desde el último resumen (p. ej. muchas
+        # pizarras seguidas) se resume por tramos antes de armar el contexto.
+        while summary_upto < total - CHAT_CONTEXT_MAX_MESSAGES:
+            upto = min(summary_upto + CHAT_CONTEXT_MAX_MESSAGES, total - CHAT_CONTEXT_MAX_MESSAGES)
+            await fold(await read_messages(collection, query, summary_upto, upto), upto)
+    except Exception as e:
+        logging.warning(f"No se pudo actualizar el resumen de la conversación {conversation_id}: {e}")
+
+    start = max(summary_upto, total - CHAT_CONTEXT_MAX_MESSAGES)
+    messages = await read_messages(collection, query, start, total)
+
+    budget = max(CHAT_CONTEXT_TOKEN_BUDGET - estimate_tokens(summary), 0)
+    if start == summary_upto and split_by_budget(messages, budget) > 0:
+        cut = split_by_budget(messages, budget // 2)
+        try:
+            await fold(messages[:cut], start + cut)
+            messages = messages[cut:]
+        except Exception as e:
+            logging.warning(f"No se pudo actualizar el resumen de la conversación {conversation_id}: {e}")
+
+    history = []
+    if summary:
+        history.append({"sender": "user", "text": f"Resumen de nuestra conversación hasta ahora: {summary}"})
+        history.append({"sender": "ai", "text": "Entendido, continúo a partir de ese resumen."})
+    history.extend({"sender": m.get("sender", "user"), "text": message_text(m)} for m in messages)
+    return history
@@ -0,0 +1,134 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import json
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "32"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "15"))
+PASSWORD_MAX_CONCURRENCY = int(os.getenv("PASSWORD_MAX_CONCURRENCY", "4"))
+PASSWORD_MAX_QUEUE = int(os.getenv("PASSWORD_MAX_QUEUE", "64"))
+PASSWORD_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_QUEUE_TIMEOUT", "10"))
+LLM_COALESCE = os.getenv("LLM_COALESCE", "true").lower() in ("1", "true", "yes")
+
+class ServiceBusyError(Exception):
+    pass
+
+# Como máximo `max_concurrency` operaciones corren a la vez y hasta `max_queue`
+# esperan turno durante `queue_timeout` segundos; fuera de eso, ServiceBusyError.
+class AdmissionGate:
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+        else:
+            if self._waiting >= self.max_queue:
+                self.rejected += 1
+                raise ServiceBusyError(f"Servicio {self.name} saturado, intenta de nuevo en unos segundos")
+
+            self._waiting += 1
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.timed_out += 1
+                raise ServiceBusyError(f"Tiempo de espera agotado en la cola de {self.name}")
+            finally:
+                self._waiting -= 1
+
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._semaphore.release()
+
+    async def run(self, func, *args, **kwargs):
+        async with self.slot():
+            return await func(*args, **kwargs)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+def request_fingerprint(*parts) -> str:
+    encoded = json.dumps(parts, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+# Las llamadas idénticas que llegan mientras otra está en curso esperan su
+# resultado en vez de repetirla. La llamada corre en su propia tarea, así que
+# si el primer cliente se desconecta los demás igual reciben la respuesta.
+class SingleFlight:
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self._calls: dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _finished(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Marca la excepción como leída aunque todos los que esperaban se hayan ido.
+            task.exception()
+
+    async def run(self, key: str, func, *args, **kwargs):
+        if not self.enabled:
+            self.calls += 1
+            return await func(*args, **kwargs)
+
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+        }
+
+llm_gate = AdmissionGate("Gemini", LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+password_gate = AdmissionGate("autenticación", PASSWORD_MAX_CONCURRENCY, PASSWORD_MAX_QUEUE, PASSWORD_QUEUE_TIMEOUT)
+analysis_flight = SingleFlight("análisis de pizarra", LLM_COALESCE)
+chat_flight = SingleFlight("chat", LLM_COALESCE)
@@ -0,0 +1,131 @@
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID
+from bson import ObjectId, Binary, DBRef
+
+from image_store import delete_unreferenced_images
+from models import User, Conversation, ChatMessage, ConversationRead, MessageRead, MessagePage, utc_now
+
+def owner_key(owner_id: UUID) -> Binary:
+    return Binary.from_uuid(owner_id)
+
+def owned_filter(conversation_id: str, owner_id: UUID) -> Optional[dict]:
+    if not ObjectId.is_valid(conversation_id):
+        return None
+    return {"_id": ObjectId(conversation_id), "owner_id": owner_key(owner_id)}
+
+async def append_messages(conversation_id: str, owner_id: UUID, messages: List[ChatMessage], job_id: Optional[str] = None) -> bool:
+    query = owned_filter(conversation_id, owner_id)
+    if query is None:
+        return False
+    collection = Conversation.get_pymongo_collection()
+    if job_id is not None:
+        # Un reintento del mismo trabajo no vuelve a agregar sus mensajes.
+        query["messages.job_id"] = {"$ne": job_id}
+    result = await collection.update_one(
+        query,
+        {
+            "$push": {"messages": {"$each": [message.model_dump() for message in messages]}},
+            "$inc": {"message_count": len(messages)},
+            "$set": {"updated_at": utc_now()}
+        }
+    )
+    if result.matched_count == 0 and job_id is not None:
+        # Sin coincidencia: no existe la conversación o ya tiene los mensajes.
+        query["messages.job_id"] = job_id
+        return await collection.count_documents(query, limit=1) > 0
+    return result.matched_count > 0
+
+async def list_conversations(owner_id: UUID, before: Optional[datetime], limit: int) -> List[ConversationRead]:
+    query = {"owner_id": owner_key(owner_id)}
+    if before is not None:
+        query["updated_at"] = {"$lt": before}
+    cursor = (
+        Conversation.get_pymongo_collection()
+        .find(query, {"title": 1, "updated_at": 1})
+        .sort([("updated_at", -1)])
+        .limit(limit)
+    )
+    return [
+        ConversationRead(id=document["_id"], title=document["title"], updated_at=document.get("updated_at"))
+        async for document in cursor
+    ]
+
+async def delete_conversation(conversation_id: str, owner_id: UUID) -> bool:
+    query = owned_filter(conversation_id, owner_id)
+    if query is None:
+        return False
+    document = await Conversation.get_pymongo_collection().find_one_and_delete(
+        query, projection={"messages.image_id": 1}
+    )
+    if document is None:
+        return False
+    image_ids = {message.get("image_id") for message in document.get("messages", []) if message.get("image_id")}
+    await delete_unreferenced_images(image_ids)
+    return True
+
+async def owns_conversation(conversation_id: str, owner_id: UUID) -> bool:
+    query = owned_filter(conversation_id, owner_id)
+    if query is None:
+        return False
+    return await Conversation.get_pymongo_collection().find_one(query, {"_id": 1}) is not None
+
+async def owns_image(image_id: str, owner_id: UUID) -> bool:
+    document = await Conversation.get_pymongo_collection().find_one(
+        {"owner_id": owner_key(owner_id), "messages.image_id": image_id}, {"_id": 1}
+    )
+    return document is not None
+
+async def get_messages_page(conversation_id: str, owner_id: UUID, before: Optional[int], limit: int) -> Optional[MessagePage]:
+    query = owned_filter(conversation_id, owner_id)
+    if query is None:
+        return None
+
+    collection = Conversation.get_pymongo_collection()
+    counts = await collection.find_one(query, {"message_count": 1})
+    if counts is None:
+        return None
+
+    total = counts.get("message_count", 0)
+    end = total if before is None else min(before, total)
+    start = max(end - limit, 0)
+    if end == start:
+        return MessagePage(messages=[], total=total)
+
+    document = await collection.find_one(
+        query,
+        {"messages": {"$slice": [start, end - start]}, "title": 1}
+    )
+    messages = [
+        MessageRead(seq=start + offset, **message)
+        for offset, message in enumerate((document or {}).get("messages", []))
+    ]
+    return MessagePage(messages=messages, total=total, next_before=start if start > 0 else None)
+
+async def backfill_message_counts():
+    collection = Conversation.get_pymongo_collection()
+    async for document in collection.find({"message_count": {"$exists": False}}, {"messages": 1}):
+        await collection.update_one(
+            {"_id": document["_id"], "message_count": {"$exists": False}},
+            {"$set": {"message_count": len(document.get("messages", []))}}
+        )
+
+# Antes la propiedad se guardaba como una lista de Links en el usuario: se
+# copia a owner_id en cada conversación y se quita la lista del documento.
+async def migrate_conversation_owners():
+    users_collection = User.get_pymongo_collection()
+    conversations = Conversation.get_pymongo_collection()
+    async for user in users_collection.find({"conversations": {"$exists": True}}, {"conversations": 1}):
+        ids = [ref.id if isinstance(ref, DBRef) else ref for ref in user.get("conversations") or []]
+        if ids:
+            await conversations.update_many(
+                {"_id": {"$in": ids}, "owner_id": None},
+                {"$set": {"owner_id": user["_id"]}}
+            )
+        await users_collection.update_one({"_id": user["_id"]}, {"$unset": {"conversations": ""}})
+
+    async for document in conversations.find({"updated_at": {"$exists": False}}, {"_id": 1}):
+        await conversations.update_one(
+            {"_id": document["_id"], "updated_at": {"$exists": False}},
+            {"$set": {"updated_at": document["_id"].generation_time}}
+        )
@@ -3,12 +3,20 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import json
-import io
 import google.generativeai as genai
-from PIL import Image
-import base64
 import logging
 import re
+import asyncio
+from typing import Optional
+
+from concurrency import llm_gate, analysis_flight
+from metrics import timed_gemini, image_stage_duration
+from image_preprocessing import preprocess_image, preprocess_gray
+from board_regions import (
+    BOARD_INCREMENTAL, incremental_stats, split_board, reusable_segments,
+    region_strip, vars_fingerprint, assigned_vars, has_errors
+)
+from analysis_cache import analysis_cache_key, get_cached_analysis, store_cached_analysis
 
 logging.basicConfig(level=logging.INFO)
 
@@ -26,7 +34,52 @@ genai.configure(api_key=GEMINI_API_KEY)
 
 model = genai.GenerativeModel('gemini-2.5-flash')
 
-def analyze_image(image_base64: str, dict_of_vars: dict):
+async def analyze_image_data(image_data: bytes, dict_of_vars: dict):
+    with image_stage_duration.time(stage="preprocess"):
+        processed_data = await asyncio.to_thread(preprocess_image, image_data)
+    if processed_data is None:
+        return []
+    return await analyze_processed_image(processed_data, dict_of_vars)
+
+async def analyze_board(image_data: bytes, dict_of_vars: dict, previous_state: Optional[dict] = None) -> tuple[list, Optional[dict]]:
+    # Análisis incremental: sólo se envían al modelo los renglones nuevos o
+    # modificados respecto al estado anterior de la pizarra de la conversación.
+    if not BOARD_INCREMENTAL:
+        return await analyze_image_data(image_data, dict_of_vars), None
+
+    with image_stage_duration.time(stage="preprocess"):
+        gray, regions = await asyncio.to_thread(split_board, image_data)
+    if not regions:
+        logging.info('Pizarra vacía, se omite el análisis')
+        return [], None
+
+    incremental_stats["boards"] += 1
+    vars_key = vars_fingerprint(dict_of_vars)
+    segments, start = reusable_segments(previous_state, regions, vars_key)
+    reused = [item for segment in segments for item in segment["results"]]
+    incremental_stats["regions_reused"] += start
+    if start == len(regions):
+        incremental_stats["model_calls_skipped"] += 1
+        logging.info(f'Pizarra sin cambios: {start} renglón(es) reutilizados')
+        return reused, {"vars": vars_key, "segments": segments}
+
+    pending = regions[start:]
+    incremental_stats["regions_analyzed"] += len(pending)
+    logging.info(f'Pizarra incremental: {start} renglón(es) reutilizados, {len(pending)} por analizar')
+    with image_stage_duration.time(stage="preprocess"):
+        processed_data = await asyncio.to_thread(preprocess_gray, region_strip(gray, pending), len(image_data))
+    if processed_data is None:
+        return reused, {"vars": vars_key, "segments": segments}
+
+    results = await analyze_processed_image(processed_data, {**dict_of_vars, **assigned_vars(reused)})
+    if not isinstance(results, list):
+        results = [results]
+    if has_errors(results):
+        return reused + results, None
+    segments = segments + [{"regions": [region["hash"] for region in pending], "results": results}]
+    return reused + results, {"vars": vars_key, "segments": segments}
+
+async def analyze_processed_image(processed_data: bytes, dict_of_vars: dict):
     dict_of_vars_str = json.dumps(dict_of_vars)
     prompt = f"""
 Se te ha dado una imagen con algunas expresiones matemáticas o ecuaciones, y necesitas resolverlas.
@@ -39,22 +92,28 @@ Formato:
 NO incluyas texto fuera del JSON.
 """
     try:
-        logging.info('Iniciando decodificación de imagen base64')
-        image_data = base64.b64decode(image_base64.split(",")[-1])
-        image = Image.open(io.BytesIO(image_data))
-        logging.info('Imagen decodificada y cargada exitosamente')
-
-        logging.info('Enviando prompt y la imagen al modelo generativo')
-        response = model.generate_content([
-            prompt,
-            image
-        ])
-
-        clean_text = clean_response_text(response.text)
-
-        parsed = json.loads(clean_text)
-        logging.info('JSON parseado exitosamente')
-        return parsed
+        cache_key = analysis_cache_key(processed_data, dict_of_vars)
+        cached = await get_cached_analysis(cache_key)
+        if cached is not None:
+            logging.info('Resultado obtenido de la caché de análisis')
+            return cached
+
+        # Pizarras idénticas que llegan a la vez comparten una sola llamada a Gemini.
+        return await analysis_flight.run(cache_key, request_analysis, cache_key, prompt, processed_data)
     except json.JSONDecodeError as e:
         logging.error(f"Error al decodificar JSON: {e}")
-        return [{"expr": "error", "result": "JSON inválido", "assign": False}]
\ No newline at end of file
+        return [{"expr": "error", "result": "JSON inválido", "assign": False}]
+
+async def request_analysis(cache_key: str, prompt: str, processed_data: bytes):
+    logging.info('Enviando prompt y la imagen al modelo generativo')
+    response = await llm_gate.run(timed_gemini, "core", model.generate_content_async, [
+        prompt,
+        {"mime_type": "image/png", "data": processed_data}
+    ])
+
+    clean_text = clean_response_text(response.text)
+
+    parsed = json.loads(clean_text)
+    logging.info('JSON parseado exitosamente')
+    await store_cached_analysis(cache_key, parsed)
+    return parsed
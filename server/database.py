@@ -1,20 +1,69 @@
 import os
+import logging
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
 
+from metrics import MongoCommandListener
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "0"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "0"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "0"))
+
+def client_options() -> dict:
+    # 0 deja el valor por defecto del driver (sin límite)
+    options = {
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "uuidRepresentation": "standard",
+        "event_listeners": [MongoCommandListener()],
+    }
+    if MONGO_MAX_IDLE_TIME_MS:
+        options["maxIdleTimeMS"] = MONGO_MAX_IDLE_TIME_MS
+    if MONGO_SOCKET_TIMEOUT_MS:
+        options["socketTimeoutMS"] = MONGO_SOCKET_TIMEOUT_MS
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    return options
+
+async def verify_indexes(document_models: list):
+    # init_beanie crea los índices declarados en Settings.indexes; aquí se
+    # comprueba que existan para fallar al iniciar y no con consultas lentas.
+    missing = []
+    for model in document_models:
+        expected = [index.document["name"] for index in getattr(model.Settings, "indexes", [])]
+        if not expected:
+            continue
+        existing = await model.get_pymongo_collection().index_information()
+        missing.extend(f"{model.Settings.name}.{name}" for name in expected if name not in existing)
+    if missing:
+        raise RuntimeError(f"Faltan índices en MongoDB: {', '.join(missing)}")
+    logging.info("Índices de MongoDB verificados")
+
 async def init_db():
     mongo_uri = os.getenv("MONGO_URI")
     
     if not mongo_uri:
         raise ValueError("MONGO_URI no está configurada")
 
-    client = AsyncIOMotorClient(mongo_uri)
+    client = AsyncIOMotorClient(mongo_uri, **client_options())
     db_name = mongo_uri.split("/")[-1].split("?")[0]
 
-    from models import User, Conversation
+    from models import User, Conversation, ImageBlob, AnalysisCacheEntry, CalculationJob
 
+    document_models = [User, Conversation, ImageBlob, AnalysisCacheEntry, CalculationJob]
     await init_beanie(
         database=client[db_name], 
-        document_models=[User, Conversation]
+        document_models=document_models
     )
-    return f"Base de datos {db_name} inicializada"
\ No newline at end of file
+    await verify_indexes(document_models)
+
+    from conversation_store import backfill_message_counts, migrate_conversation_owners
+    await backfill_message_counts()
+    await migrate_conversation_owners()
+    return f"Base de datos {db_name} inicializada"
@@ -0,0 +1,157 @@
+import os
+import math
+import random
+from collections import deque
+from fractions import Fraction
+from typing import List
+from uuid import uuid4
+from pydantic import BaseModel, Field
+
+from cache import CountingCache
+from mcp_tools import TipoEcuacion, resolver_ecuacion_lineal, resolver_ecuacion_cuadratica
+
+EXERCISE_POOL_SIZE = int(os.getenv("EXERCISE_POOL_SIZE", "50"))
+EXERCISE_INDEX_SIZE = int(os.getenv("EXERCISE_INDEX_SIZE", "5000"))
+EXERCISE_INDEX_TTL = int(os.getenv("EXERCISE_INDEX_TTL", "86400"))
+DIFICULTADES = (1, 2, 3)
+
+class Ejercicio(BaseModel):
+    id: str = Field(description="Identificador del ejercicio")
+    tema: TipoEcuacion = Field(description="Tipo de ecuación")
+    dificultad: int = Field(description="Nivel de dificultad de 1 a 3")
+    enunciado: str = Field(description="Consigna para el estudiante")
+    ecuacion: str = Field(description="Ecuación a resolver")
+    soluciones: List[float] = Field(description="Soluciones reales de la ecuación")
+    resolucion: dict = Field(description="Resolución paso a paso calculada con las herramientas")
+
+class RespuestaEjercicio(BaseModel):
+    respuestas: List[float] = Field(description="Valores de x propuestos por el estudiante")
+
+class ResultadoRespuesta(BaseModel):
+    correcta: bool
+    soluciones: List[float]
+
+rng = random.Random()
+pools: dict[tuple[TipoEcuacion, int], deque] = {}
+ejercicios_por_id = CountingCache(maxsize=EXERCISE_INDEX_SIZE, ttl=EXERCISE_INDEX_TTL)
+
+def format_term(coeficiente, variable: str, primero: bool) -> str:
+    if coeficiente == 0:
+        return ""
+    signo = "-" if coeficiente < 0 else ("" if primero else "+")
+    valor = abs(coeficiente)
+    texto = "" if variable and valor == 1 else str(valor)
+    termino = f"{texto}{variable}"
+    return f"{signo}{termino}" if primero else f" {signo} {termino}"
+
+def format_polynomial(*terminos: tuple) -> str:
+    partes = []
+    for coeficiente, variable in terminos:
+        partes.append(format_term(coeficiente, variable, primero=not "".join(partes)))
+    return "".join(partes) or "0"
+
+def nice_root(denominadores: tuple, limite: int) -> Fraction:
+    return Fraction(rng.randint(-limite, limite), rng.choice(denominadores))
+
+def nonzero(limite: int) -> int:
+    return rng.choice([n for n in range(-limite, limite + 1) if n != 0])
+
+def generate_linear(dificultad: int) -> tuple[str, float, float]:
+    if dificultad == 1:
+        m = rng.randint(1, 6)
+        raiz = Fraction(rng.randint(-10, 10))
+    elif dificultad == 2:
+        raiz = nice_root((1, 2), 10)
+        m = nonzero(9) * raiz.denominator
+    else:
+        raiz = nice_root((1, 2, 3, 4), 12)
+        m = nonzero(6) * raiz.denominator
+    b = -m * raiz
+
+    if dificultad == 3:
+        # Forma con x en ambos lados: (m + k)x + (b + d) = kx + d
+        k = nonzero(5)
+        d = rng.randint(-9, 9)
+        izquierda = format_polynomial((m + k, "x"), (int(b + d), ""))
+        derecha = format_polynomial((k, "x"), (d, ""))
+        return f"{izquierda} = {derecha}", float(m), float(b)
+    return f"{format_polynomial((m, 'x'), (int(b), ''))} = 0", float(m), float(b)
+
+def generate_quadratic(dificultad: int) -> tuple[str, float, float, float]:
+    if dificultad == 1:
+        a = 1
+        r1, r2 = Fraction(rng.randint(-6, 6)), Fraction(rng.randint(-6, 6))
+    elif dificultad == 2:
+        a = nonzero(3)
+        r1, r2 = Fraction(rng.randint(-9, 9)), Fraction(rng.randint(-9, 9))
+    else:
+        r1, r2 = nice_root((1, 2, 3), 9), nice_root((1, 2, 3), 9)
+        a = nonzero(2) * r1.denominator * r2.denominator
+    b = -a * (r1 + r2)
+    c = a * r1 * r2
+    ecuacion = f"{format_polynomial((a, 'x²'), (int(b), 'x'), (int(c), ''))} = 0"
+    return ecuacion, float(a), float(b), float(c)
+
+def create_exercise(tema: TipoEcuacion, dificultad: int) -> Ejercicio:
+    if tema == TipoEcuacion.lineal:
+        ecuacion, m, b = generate_linear(dificultad)
+        resolucion = resolver_ecuacion_lineal(m, b)
+        soluciones = [resolucion["solucion"]]
+    else:
+        ecuacion, a, b, c = generate_quadratic(dificultad)
+        resolucion = resolver_ecuacion_cuadratica(a, b, c)
+        soluciones = resolucion["soluciones"]
+
+    return Ejercicio(
+        id=uuid4().hex,
+        tema=tema,
+        dificultad=dificultad,
+        enunciado=f"Resuelve la ecuación: {ecuacion}",
+        ecuacion=ecuacion,
+        soluciones=[solucion + 0.0 for solucion in soluciones],
+        resolucion=resolucion
+    )
+
+def refill_pool(tema: TipoEcuacion, dificultad: int) -> deque:
+    pool = pools.setdefault((tema, dificultad), deque())
+    vistas = {ejercicio.ecuacion for ejercicio in pool}
+    intentos = 0
+    while len(pool) < EXERCISE_POOL_SIZE and intentos < EXERCISE_POOL_SIZE * 4:
+        intentos += 1
+        ejercicio = create_exercise(tema, dificultad)
+        if ejercicio.ecuacion not in vistas:
+            vistas.add(ejercicio.ecuacion)
+            pool.append(ejercicio)
+    return pool
+
+def warm_up():
+    for tema in TipoEcuacion:
+        for dificultad in DIFICULTADES:
+            refill_pool(tema, dificultad)
+
+def obtener_ejercicio(tema: str = "lineal", dificultad: int = 1) -> Ejercicio:
+    try:
+        tema = TipoEcuacion(tema)
+    except ValueError:
+        raise ValueError(f"Tema no soportado: '{tema}'. Usa 'lineal' o 'cuadratica'")
+    dificultad = int(dificultad)
+    if dificultad not in DIFICULTADES:
+        raise ValueError("La dificultad debe ser 1, 2 o 3")
+
+    pool = pools.get((tema, dificultad))
+    if not pool:
+        pool = refill_pool(tema, dificultad)
+    ejercicio = pool.popleft()
+    ejercicios_por_id.set(ejercicio.id, ejercicio)
+    return ejercicio
+
+def buscar_ejercicio(ejercicio_id: str):
+    return ejercicios_por_id.get(ejercicio_id)
+
+def verificar_respuesta(ejercicio: Ejercicio, respuestas: List[float]) -> bool:
+    # Sin importar el orden; una raíz doble se puede escribir una o dos veces.
+    esperadas = sorted(set(round(solucion, 6) for solucion in ejercicio.soluciones))
+    dadas = sorted(set(round(respuesta, 6) for respuesta in respuestas))
+    return len(esperadas) == len(dadas) and all(
+        math.isclose(esperada, dada, rel_tol=1e-6, abs_tol=1e-6) for esperada, dada in zip(esperadas, dadas)
+    )
@@ -0,0 +1,243 @@
+import os
+import re
+import math
+import operator
+from functools import lru_cache
+from typing import Iterable, Optional
+
+EXPRESSION_MAX_LENGTH = int(os.getenv("EXPRESSION_MAX_LENGTH", "500"))
+EXPRESSION_MAX_DEPTH = int(os.getenv("EXPRESSION_MAX_DEPTH", "100"))
+EXPRESSION_MAX_EXPONENT = float(os.getenv("EXPRESSION_MAX_EXPONENT", "1000"))
+EXPRESSION_CACHE_SIZE = int(os.getenv("EXPRESSION_CACHE_SIZE", "1024"))
+
+class ExpressionError(ValueError):
+    pass
+
+FUNCTIONS = {
+    "sqrt": (math.sqrt, 1),
+    "sin": (math.sin, 1),
+    "cos": (math.cos, 1),
+    "tan": (math.tan, 1),
+    "log": (math.log10, 1),
+}
+
+CONSTANTS = {
+    "pi": math.pi,
+    "e": math.e,
+}
+
+TOKEN = re.compile(r"\s*(?:(\d+\.?\d*|\.\d+)|([a-z_][a-z0-9_]*)|(\*\*|[+\-*/^(),]))", re.IGNORECASE)
+
+def tokenize(expresion: str) -> list[tuple[str, str]]:
+    tokens = []
+    position = 0
+    expresion = expresion.rstrip()
+    while position < len(expresion):
+        match = TOKEN.match(expresion, position)
+        if not match:
+            raise ExpressionError(f"Caracteres no permitidos en: '{expresion}'")
+        number, name, symbol = match.groups()
+        if number is not None:
+            # "1.2.3" o "2 3" no son multiplicación implícita sino un número mal escrito.
+            if tokens and tokens[-1][0] == "num":
+                raise ExpressionError(f"Número mal formado en: '{expresion}'")
+            tokens.append(("num", number))
+        elif name is not None:
+            tokens.append(("name", name.lower()))
+        else:
+            tokens.append(("op", "^" if symbol == "**" else symbol))
+        position = match.end()
+    return tokens
+
+# Nodos del árbol: ("num", valor), ("var", nombre), ("neg", nodo),
+# ("bin", operador, izquierda, derecha) y ("call", función, [argumentos]).
+BINARY_PRECEDENCE = {"+": 10, "-": 10, "*": 20, "/": 20, "^": 40}
+UNARY_PRECEDENCE = 30
+
+class Parser:
+    def __init__(self, tokens: list[tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+        self.depth = 0
+
+    def peek(self) -> Optional[tuple[str, str]]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self) -> tuple[str, str]:
+        token = self.peek()
+        if token is None:
+            raise ExpressionError("Expresión incompleta")
+        self.position += 1
+        return token
+
+    def expect(self, symbol: str):
+        token = self.take()
+        if token != ("op", symbol):
+            raise ExpressionError(f"Se esperaba '{symbol}' y se encontró '{token[1]}'")
+
+    def parse(self):
+        if not self.tokens:
+            raise ExpressionError("La expresión está vacía")
+        node = self.expression(0)
+        if self.peek() is not None:
+            raise ExpressionError(f"Símbolo inesperado: '{self.peek()[1]}'")
+        return node
+
+    def expression(self, min_precedence: int):
+        # Paréntesis, signos y potencias anidan la recursión; se corta antes del
+        # límite de Python para responder con ExpressionError.
+        self.depth += 1
+        if self.depth > EXPRESSION_MAX_DEPTH:
+            raise ExpressionError(f"La expresión supera {EXPRESSION_MAX_DEPTH} niveles de anidamiento")
+        try:
+            return self.operations(min_precedence)
+        finally:
+            self.depth -= 1
+
+    def operations(self, min_precedence: int):
+        left = self.prefix()
+        while True:
+            token = self.peek()
+            if token is None:
+                return left
+            kind, value = token
+            if kind == "op" and value in BINARY_PRECEDENCE:
+                precedence = BINARY_PRECEDENCE[value]
+                if precedence < min_precedence:
+                    return left
+                self.take()
+                # ^ es asociativo a la derecha: 2^3^2 = 2^(3^2)
+                next_precedence = precedence if value == "^" else precedence + 1
+                left = ("bin", value, left, self.expression(next_precedence))
+            elif kind in ("num", "name") or token == ("op", "("):
+                # Multiplicación implícita: 2x, 3(x + 1), (x + 1)(x - 1)
+                if BINARY_PRECEDENCE["*"] < min_precedence:
+                    return left
+                left = ("bin", "*", left, self.expression(BINARY_PRECEDENCE["*"] + 1))
+            else:
+                return left
+
+    def prefix(self):
+        kind, value = self.take()
+        if kind == "num":
+            return ("num", float(value))
+        if kind == "name":
+            if value in FUNCTIONS:
+                self.expect("(")
+                arguments = [self.expression(0)]
+                while self.peek() == ("op", ","):
+                    self.take()
+                    arguments.append(self.expression(0))
+                self.expect(")")
+                if len(arguments) != FUNCTIONS[value][1]:
+                    raise ExpressionError(f"La función {value} recibe {FUNCTIONS[value][1]} argumento(s)")
+                return ("call", value, arguments)
+            if value in CONSTANTS:
+                return ("num", CONSTANTS[value])
+            return ("var", value)
+        if value == "(":
+            node = self.expression(0)
+            self.expect(")")
+            return node
+        if value in ("-", "+"):
+            operand = self.expression(UNARY_PRECEDENCE)
+            return ("neg", operand) if value == "-" else operand
+        raise ExpressionError(f"Símbolo inesperado: '{value}'")
+
+def power(base: float, exponent: float) -> float:
+    if abs(exponent) > EXPRESSION_MAX_EXPONENT:
+        raise ExpressionError(f"El exponente {exponent:g} supera el máximo permitido ({EXPRESSION_MAX_EXPONENT:g})")
+    return math.pow(base, exponent)
+
+BINARY_OPERATIONS = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "/": operator.truediv,
+    "^": power,
+}
+
+def emit(node, code: list, variables: set):
+    kind = node[0]
+    if kind == "num":
+        code.append(("const", node[1]))
+    elif kind == "var":
+        variables.add(node[1])
+        code.append(("load", node[1]))
+    elif kind == "neg":
+        emit(node[1], code, variables)
+        code.append(("neg", None))
+    elif kind == "bin":
+        emit(node[2], code, variables)
+        emit(node[3], code, variables)
+        code.append(("bin", BINARY_OPERATIONS[node[1]]))
+    elif kind == "call":
+        for argument in node[2]:
+            emit(argument, code, variables)
+        code.append(("call", (node[1], FUNCTIONS[node[1]][0], len(node[2]))))
+
+class CompiledExpression:
+    def __init__(self, source: str, code: list, variables: frozenset):
+        self.source = source
+        self.code = code
+        self.variables = variables
+
+    def evaluate(self, variables: Optional[dict] = None) -> float:
+        variables = variables or {}
+        missing = self.variables - variables.keys()
+        if missing:
+            raise ExpressionError(f"Variables sin valor: {', '.join(sorted(missing))}")
+
+        stack = []
+        try:
+            for instruction, argument in self.code:
+                if instruction == "const":
+                    stack.append(argument)
+                elif instruction == "load":
+                    stack.append(float(variables[argument]))
+                elif instruction == "neg":
+                    stack.append(-stack.pop())
+                elif instruction == "bin":
+                    right = stack.pop()
+                    stack.append(argument(stack.pop(), right))
+                else:
+                    name, function, count = argument
+                    arguments = stack[-count:]
+                    del stack[-count:]
+                    try:
+                        stack.append(function(*arguments))
+                    except ValueError:
+                        # math responde "math domain error" fuera del dominio.
+                        valores = ", ".join(f"{value:g}" for value in arguments)
+                        raise ExpressionError(f"{name}({valores}) no está definida")
+        except ZeroDivisionError:
+            raise ExpressionError("División por cero")
+        except OverflowError:
+            raise ExpressionError("El resultado es demasiado grande")
+
+        result = stack.pop()
+        if not math.isfinite(result):
+            raise ExpressionError("El resultado no es un número finito")
+        return result
+
+    def evaluate_many(self, bindings: Iterable[dict]) -> list[Optional[float]]:
+        results = []
+        for variables in bindings:
+            try:
+                results.append(self.evaluate(variables))
+            except (ExpressionError, ValueError):
+                results.append(None)
+        return results
+
+@lru_cache(maxsize=EXPRESSION_CACHE_SIZE)
+def compile_expression(expresion: str) -> CompiledExpression:
+    if len(expresion) > EXPRESSION_MAX_LENGTH:
+        raise ExpressionError(f"La expresión supera los {EXPRESSION_MAX_LENGTH} caracteres")
+    tree = Parser(tokenize(expresion)).parse()
+    code = []
+    variables = set()
+    emit(tree, code, variables)
+    return CompiledExpression(expresion, code, frozenset(variables))
+
+def evaluate(expresion: str, variables: Optional[dict] = None) -> float:
+    return compile_expression(expresion.strip()).evaluate(variables)
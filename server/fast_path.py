@@ -0,0 +1,216 @@
+import re
+import logging
+from typing import Optional
+
+from mcp_tools import resolver_ecuacion_lineal, resolver_ecuacion_cuadratica, realizar_operacion
+from expression_engine import EXPRESSION_MAX_LENGTH
+
+fast_path_stats = {
+    "hits": 0,
+    "misses": 0,
+    "lineal": 0,
+    "cuadratica": 0,
+    "operacion": 0,
+}
+
+PREFIX = re.compile(
+    r"^(?:por\s+favor,?\s*)?(?:(?:puedes|podrías|podrias|me\s+ayudas\s+a)\s+)?"
+    r"(?:resuelve|resuélveme|resuelveme|resolver|calcula|calcular|calculá|halla|hallar|encuentra|"
+    r"cu[aá]nto\s+(?:es|da|vale)|cu[aá]l\s+es\s+el\s+resultado\s+de)\s*"
+    r"(?:la\s+ecuaci[oó]n|la\s+operaci[oó]n|el\s+resultado\s+de|x\s+en)?\s*:?\s*"
+)
+SUFFIX = re.compile(r"\s*(?:,?\s*por\s+favor)?\s*[?.!]*\s*$")
+MATH_ONLY = re.compile(r"^[0-9x+\-*/^().,=\s]+$")
+TOKEN = re.compile(r"\s*(?:(\d+(?:\.\d+)?)|(x)|([+\-*/^()]))")
+
+def normalize_message(message: str) -> Optional[str]:
+    text = message.strip().lower().lstrip("¿¡").strip()
+    for original, replacement in (("²", "^2"), ("−", "-"), ("·", "*"), ("×", "*"), ("÷", "/"), ("**", "^")):
+        text = text.replace(original, replacement)
+
+    text = PREFIX.sub("", text, count=1)
+    text = SUFFIX.sub("", text, count=1)
+    text = re.sub(r"(\d),(\d)", r"\1.\2", text)
+    if not text or not MATH_ONLY.match(text) or not re.search(r"\d", text):
+        return None
+    return text
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = TOKEN.match(text, position)
+        if not match:
+            raise ValueError(f"Símbolo inesperado en '{text[position:]}'")
+        tokens.append(match.group(match.lastindex))
+        position = match.end()
+    return tokens
+
+def poly_add(p, q, sign=1):
+    return tuple(a + sign * b for a, b in zip(p, q))
+
+def poly_mul(p, q):
+    result = [0.0, 0.0, 0.0]
+    for i, a in enumerate(p):
+        for j, b in enumerate(q):
+            if a and b:
+                if i + j > 2:
+                    raise ValueError("Grado mayor que 2")
+                result[i + j] += a * b
+    return tuple(result)
+
+# Analizador descendente que reduce cada lado de la ecuación a un polinomio
+# (c0, c1, c2) en x; cualquier cosa fuera de grado 2 se deja para Gemini.
+class PolynomialParser:
+    def __init__(self, text: str):
+        self.tokens = tokenize(text)
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.peek()
+        self.position += 1
+        return token
+
+    def parse(self):
+        result = self.expression()
+        if self.peek() is not None:
+            raise ValueError(f"Símbolo inesperado: {self.peek()}")
+        return result
+
+    def expression(self):
+        result = self.term()
+        while self.peek() in ("+", "-"):
+            sign = 1 if self.take() == "+" else -1
+            result = poly_add(result, self.term(), sign)
+        return result
+
+    def term(self):
+        result = self.factor()
+        while True:
+            token = self.peek()
+            if token == "*":
+                self.take()
+                result = poly_mul(result, self.factor())
+            elif token == "/":
+                self.take()
+                divisor = self.factor()
+                if divisor[1] or divisor[2] or divisor[0] == 0:
+                    raise ValueError("Sólo se admite dividir por constantes distintas de cero")
+                result = tuple(c / divisor[0] for c in result)
+            elif token in ("x", "("):
+                result = poly_mul(result, self.factor())
+            else:
+                return result
+
+    def factor(self):
+        token = self.peek()
+        if token in ("+", "-"):
+            self.take()
+            value = self.factor()
+            return value if token == "+" else tuple(-c for c in value)
+        return self.power()
+
+    def power(self):
+        base = self.atom()
+        if self.peek() != "^":
+            return base
+        self.take()
+        exponent = self.factor()
+        if exponent[1] or exponent[2] or exponent[0] not in (0, 1, 2):
+            raise ValueError("Exponente no soportado")
+        result = (1.0, 0.0, 0.0)
+        for _ in range(int(exponent[0])):
+            result = poly_mul(result, base)
+        return result
+
+    def atom(self):
+        token = self.take()
+        if token is None:
+            raise ValueError("Expresión incompleta")
+        if token == "x":
+            return (0.0, 1.0, 0.0)
+        if token == "(":
+            value = self.expression()
+            if self.take() != ")":
+                raise ValueError("Falta cerrar un paréntesis")
+            return value
+        if token[0].isdigit():
+            return (float(token), 0.0, 0.0)
+        raise ValueError(f"Símbolo inesperado: {token}")
+
+def format_number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else f"{value:.4f}".rstrip("0")
+
+def format_steps(pasos: list[str]) -> str:
+    return "\n".join(f"{number}. {paso}" for number, paso in enumerate(pasos, start=1))
+
+def render_linear(original: str, solution: dict) -> str:
+    return (
+        f"Resolvamos la ecuación lineal {original} paso a paso:\n\n"
+        f"{format_steps(solution['pasos'])}\n\n"
+        f"{solution['verificacion']}\n\n"
+        f"**Solución:** x = {format_number(solution['solucion'])}\n\n"
+        "¿Quieres intentar una parecida en la pizarra?"
+    )
+
+def render_quadratic(original: str, solution: dict) -> str:
+    soluciones = solution["soluciones"]
+    if len(soluciones) == 2:
+        conclusion = f"x₁ = {format_number(soluciones[0])} y x₂ = {format_number(soluciones[1])}"
+    elif len(soluciones) == 1:
+        conclusion = f"x = {format_number(soluciones[0])} (solución doble)"
+    else:
+        conclusion = "no tiene soluciones reales porque el discriminante es negativo"
+    return (
+        f"Resolvamos la ecuación cuadrática {original} con la fórmula general:\n\n"
+        f"{format_steps(solution['pasos'])}\n\n"
+        f"**{solution['tipo_solucion']}:** {conclusion}\n\n"
+        "¿Quieres intentar una parecida en la pizarra?"
+    )
+
+def render_operation(original: str, result: dict) -> str:
+    return (
+        f"Calculemos {original}:\n\n"
+        f"{format_steps(result['pasos'])}\n\n"
+        f"**Resultado:** {format_number(result['resultado'])}"
+    )
+
+def solve_text(text: str) -> Optional[str]:
+    if "=" in text:
+        sides = text.split("=")
+        if len(sides) != 2 or "x" not in text or "x" in (sides[0].strip(), sides[1].strip()):
+            return None
+        left = PolynomialParser(sides[0]).parse()
+        right = PolynomialParser(sides[1]).parse()
+        c, b, a = poly_add(left, right, -1)
+        original = text.strip()
+        if a != 0:
+            fast_path_stats["cuadratica"] += 1
+            return render_quadratic(original, resolver_ecuacion_cuadratica(a, b, c))
+        if b != 0:
+            fast_path_stats["lineal"] += 1
+            return render_linear(original, resolver_ecuacion_lineal(b, c))
+        return None
+
+    if "x" in text or not re.search(r"[\d)]\s*[+\-*/^]", text):
+        return None
+    result = realizar_operacion(text)
+    fast_path_stats["operacion"] += 1
+    return render_operation(text.strip(), result)
+
+def try_fast_answer(message: str) -> Optional[str]:
+    answer = None
+    # Los mensajes largos no son "sólo una ecuación" y van directo a Gemini.
+    text = normalize_message(message) if len(message) <= EXPRESSION_MAX_LENGTH else None
+    if text is not None:
+        try:
+            answer = solve_text(text)
+        except (ValueError, ArithmeticError, RecursionError) as e:
+            logging.info(f"Ruta rápida descartada para '{message}': {e}")
+
+    fast_path_stats["hits" if answer else "misses"] += 1
+    return answer
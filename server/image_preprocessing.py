@@ -0,0 +1,64 @@
+import os
+import io
+import logging
+from typing import Optional
+from PIL import Image
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+IMAGE_INK_THRESHOLD = int(os.getenv("IMAGE_INK_THRESHOLD", "200"))
+IMAGE_CROP_MARGIN = int(os.getenv("IMAGE_CROP_MARGIN", "16"))
+IMAGE_BINARIZE = os.getenv("IMAGE_BINARIZE", "true").lower() in ("1", "true", "yes")
+
+preprocessing_stats = {
+    "requests": 0,
+    "blank_skipped": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+}
+
+def normalize_image(image: Image.Image) -> Image.Image:
+    if image.mode in ("RGBA", "LA", "P"):
+        rgba = image.convert("RGBA")
+        background = Image.new("RGBA", rgba.size, (255, 255, 255, 255))
+        image = Image.alpha_composite(background, rgba)
+    return image.convert("L")
+
+def ink_mask(gray: Image.Image) -> Image.Image:
+    return gray.point(lambda p: 255 if p < IMAGE_INK_THRESHOLD else 0)
+
+def preprocess_image(image_data: bytes) -> Optional[bytes]:
+    preprocessing_stats["requests"] += 1
+    preprocessing_stats["bytes_in"] += len(image_data)
+    return preprocess_gray(normalize_image(Image.open(io.BytesIO(image_data))), len(image_data))
+
+def preprocess_gray(gray: Image.Image, original_size: int) -> Optional[bytes]:
+    bbox = ink_mask(gray).getbbox()
+    if bbox is None:
+        preprocessing_stats["blank_skipped"] += 1
+        logging.info('Pizarra vacía, se omite el análisis')
+        return None
+
+    left, top, right, bottom = bbox
+    gray = gray.crop((
+        max(left - IMAGE_CROP_MARGIN, 0),
+        max(top - IMAGE_CROP_MARGIN, 0),
+        min(right + IMAGE_CROP_MARGIN, gray.width),
+        min(bottom + IMAGE_CROP_MARGIN, gray.height)
+    ))
+    gray.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.Resampling.LANCZOS)
+
+    if IMAGE_BINARIZE:
+        processed = gray.point(lambda p: 0 if p < IMAGE_INK_THRESHOLD else 255).convert("1")
+    else:
+        processed = gray
+
+    output = io.BytesIO()
+    processed.save(output, format="PNG", optimize=True)
+    processed_data = output.getvalue()
+
+    preprocessing_stats["bytes_out"] += len(processed_data)
+    logging.info(
+        f'Imagen preprocesada: {original_size} -> {len(processed_data)} bytes '
+        f'({original_size - len(processed_data)} bytes ahorrados, {processed.width}x{processed.height})'
+    )
+    return processed_data
@@ -0,0 +1,46 @@
+import base64
+import hashlib
+from typing import Optional
+from pymongo.errors import DuplicateKeyError
+
+from models import ImageBlob, Conversation, CalculationJob
+
+def decode_data_url(image_base64: str) -> tuple[bytes, str]:
+    header, _, payload = image_base64.rpartition(",")
+    content_type = "image/png"
+    if header.startswith("data:"):
+        content_type = header[len("data:"):].split(";")[0] or content_type
+    return base64.b64decode(payload), content_type
+
+def sniff_content_type(data: bytes) -> Optional[str]:
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    return None
+
+async def store_image_data(data: bytes, content_type: str) -> str:
+    image_id = hashlib.sha256(data).hexdigest()
+    blob = ImageBlob(id=image_id, data=data, content_type=content_type, size=len(data))
+    try:
+        await blob.insert()
+    except DuplicateKeyError:
+        pass
+    return image_id
+
+async def get_image(image_id: str) -> Optional[ImageBlob]:
+    return await ImageBlob.get(image_id)
+
+async def delete_unreferenced_images(image_ids: set):
+    # Las imágenes se comparten por contenido: sólo se borran si ya ninguna
+    # conversación ni trabajo pendiente las usa.
+    conversations = Conversation.get_pymongo_collection()
+    jobs = CalculationJob.get_pymongo_collection()
+    for image_id in image_ids:
+        if await conversations.find_one({"messages.image_id": image_id}, {"_id": 1}):
+            continue
+        if await jobs.find_one({"image_id": image_id, "status": {"$in": ["queued", "running"]}}, {"_id": 1}):
+            continue
+        await ImageBlob.get_pymongo_collection().delete_one({"_id": image_id})
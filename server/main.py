@@ -1,31 +1,70 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Query, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse, PlainTextResponse
 from datetime import datetime, timedelta
-from typing import List
+from typing import List, Optional
 from uuid import UUID
 from contextlib import asynccontextmanager
+import os
 import json
+import math
+from PIL import UnidentifiedImageError
+from beanie import PydanticObjectId
+from pymongo.errors import DuplicateKeyError
 
-from core import analyze_image
+from core import analyze_board
 from database import init_db
+from image_store import decode_data_url, sniff_content_type, store_image_data, get_image, delete_unreferenced_images
+from calculation_jobs import job_queue, job_read, JobFailed, FINISHED, JOB_POLL_INTERVAL
+from conversation_store import (
+    append_messages, list_conversations, get_messages_page,
+    delete_conversation as delete_conversation_by_id, owns_image, owns_conversation
+)
+from concurrency import (
+    ServiceBusyError, LLM_QUEUE_TIMEOUT, PASSWORD_QUEUE_TIMEOUT, llm_gate, password_gate,
+    analysis_flight, chat_flight
+)
 import auth
 from models import (
     User, UserCreate, UserRead, 
-    Conversation, ConversationRead, 
-    CalculateRequest, Token,
+    Conversation, ConversationRead, MessagePage,
+    CalculateRequest, CalculateJobRequest, CalculationJob, CalculationJobRead, Token,
     ChatRequest, ChatResponse, ChatMessage
 )
-from chat_agent import get_tutor_response
-from mcp_tools import TOOLS_METADATA, TOOLS_FUNCTIONS
+from chat_agent import get_tutor_response, stream_tutor_response
+from chat_memory import build_chat_history
+from mcp_server import (
+    handle_payload, stream_payload, session_stream, get_session, close_session,
+    rpc_error, PARSE_ERROR, INVALID_REQUEST, METHOD_NOT_FOUND, INTERNAL_ERROR
+)
+from tool_executor import tool_executor
+from exercise_bank import (
+    Ejercicio, RespuestaEjercicio, ResultadoRespuesta, obtener_ejercicio, buscar_ejercicio, verificar_respuesta,
+    ejercicios_por_id, warm_up as warm_up_exercises
+)
+from analysis_cache import analysis_cache_stats
+from answer_cache import answer_cache_stats
+from fast_path import fast_path_stats
+from image_preprocessing import preprocessing_stats
+from board_regions import board_states, board_state_key, board_state_stats
+from mcp_server import sessions as mcp_sessions
+from metrics import MetricsMiddleware, register_collector, render_metrics, image_stage_duration
+
+WHITEBOARD_MAX_BYTES = int(os.getenv("WHITEBOARD_MAX_BYTES", str(10 * 1024 * 1024)))
+WHITEBOARD_CONTENT_TYPES = {"image/png", "image/webp", "image/jpeg"}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Iniciando servidor...")
     await init_db()
+    warm_up_exercises()
+    await tool_executor.warm_up()
+    await job_queue.start(run_whiteboard_job)
     print("Servidor MCP del Tutor de Matemáticas activo")
     yield
+    await job_queue.stop()
+    tool_executor.shutdown()
     print("Servidor cerrándose.")
 
 app = FastAPI(
@@ -40,7 +79,56 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Mcp-Session-Id"],
 )
+app.add_middleware(MetricsMiddleware)
+
+@register_collector
+def component_metrics() -> list:
+    caches = {
+        "analysis": analysis_cache_stats(),
+        "answer": answer_cache_stats(),
+        "user": auth.user_cache.stats(),
+        "token": auth.token_cache.stats(),
+        "exercise": ejercicios_por_id.stats(),
+        "mcp_session": mcp_sessions.stats(),
+        "board_state": board_states.stats(),
+    }
+    gates = {"gemini": llm_gate.stats(), "password": password_gate.stats()}
+    flights = {"analysis": analysis_flight.stats(), "chat": chat_flight.stats()}
+    jobs = job_queue.stats()
+    return [
+        ("cache_hits_total", "counter", "Aciertos por caché", [({"cache": name}, c["hits"]) for name, c in caches.items()]),
+        ("cache_misses_total", "counter", "Fallos por caché", [({"cache": name}, c["misses"]) for name, c in caches.items()]),
+        ("cache_hit_ratio", "gauge", "Proporción de aciertos por caché", [({"cache": name}, c["hit_ratio"]) for name, c in caches.items()]),
+        ("cache_entries", "gauge", "Entradas actuales por caché", [({"cache": name}, c["size"]) for name, c in caches.items()]),
+        ("analysis_cache_persistent_hits_total", "counter", "Aciertos de la caché de análisis servidos desde MongoDB",
+         [({}, caches["analysis"]["persistent_hits"])]),
+        ("admission_in_flight", "gauge", "Operaciones en curso por cola de admisión", [({"gate": name}, g["in_flight"]) for name, g in gates.items()]),
+        ("admission_waiting", "gauge", "Operaciones esperando turno por cola de admisión", [({"gate": name}, g["waiting"]) for name, g in gates.items()]),
+        ("admission_rejected_total", "counter", "Operaciones rechazadas con cola llena", [({"gate": name}, g["rejected"]) for name, g in gates.items()]),
+        ("admission_timed_out_total", "counter", "Operaciones que agotaron la espera en cola", [({"gate": name}, g["timed_out"]) for name, g in gates.items()]),
+        ("coalesced_calls_total", "counter", "Llamadas a Gemini realizadas o ahorradas al unir peticiones idénticas en curso",
+         [({"flight": name, "kind": kind}, f[kind]) for name, f in flights.items() for kind in ("calls", "coalesced")]),
+        ("coalesced_in_flight", "gauge", "Llamadas únicas en curso que otras peticiones pueden esperar", [({"flight": name}, f["in_flight"]) for name, f in flights.items()]),
+        ("fast_path_total", "counter", "Mensajes de chat evaluados por la ruta rápida", [({"result": key}, value) for key, value in fast_path_stats.items()]),
+        ("image_preprocessing_total", "counter", "Contadores del preprocesado de pizarras", [({"kind": key}, value) for key, value in preprocessing_stats.items()]),
+        ("board_incremental_total", "counter", "Renglones de pizarra reutilizados o enviados al modelo en el análisis incremental",
+         [({"kind": key}, value) for key, value in board_state_stats().items() if key in ("boards", "regions_reused", "regions_analyzed", "model_calls_skipped")]),
+        ("calculation_jobs", "gauge", "Trabajos de /calculate/jobs en cola y en curso",
+         [({"state": "queued"}, jobs["queued"]), ({"state": "running"}, jobs["running"])]),
+        ("calculation_jobs_total", "counter", "Trabajos de /calculate/jobs por resultado",
+         [({"outcome": key}, jobs[key]) for key in ("submitted", "completed", "failed", "retried", "rejected")]),
+        ("tool_pool_recycled_total", "counter", "Veces que se recreó el pool de herramientas", [({}, tool_executor.recycled)]),
+    ]
+
+def busy_exception(error: ServiceBusyError, retry_after: float = LLM_QUEUE_TIMEOUT) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(error),
+        # Retry-After sólo admite segundos enteros; 0 invitaría a reintentar ya.
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
 
 @app.post("/register", response_model=UserRead, status_code=status.HTTP_201_CREATED)
 async def register_user(user_create: UserCreate):
@@ -50,7 +138,10 @@ async def register_user(user_create: UserCreate):
             status_code=status.HTTP_400_BAD_REQUEST, 
             detail="El correo electrónico ya está registrado"
         )
-    hashed_password = auth.get_password_hash(user_create.password)
+    try:
+        hashed_password = await auth.get_password_hash(user_create.password)
+    except ServiceBusyError as e:
+        raise busy_exception(e, PASSWORD_QUEUE_TIMEOUT)
     db_user = User(
         name=user_create.name,
         email=user_create.email,
@@ -61,7 +152,10 @@ async def register_user(user_create: UserCreate):
 
 @app.post("/token", response_model=Token)
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
-    user = await auth.authenticate_user(email=form_data.username, password=form_data.password)
+    try:
+        user = await auth.authenticate_user(email=form_data.username, password=form_data.password)
+    except ServiceBusyError as e:
+        raise busy_exception(e, PASSWORD_QUEUE_TIMEOUT)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -79,105 +173,440 @@ async def read_users_me(current_user: User = Depends(auth.get_current_user)):
     return current_user
 
 @app.get("/conversations", response_model=List[ConversationRead])
-async def get_user_conversations(current_user: User = Depends(auth.get_current_user)):
-    if not current_user.conversations:
-        return []
-    conversation_ids = [conv.ref.id for conv in current_user.conversations]
-    conversations = await Conversation.find({"_id": {"$in": conversation_ids}}).to_list()
-    return conversations
+async def get_user_conversations(
+    before: Optional[datetime] = None,
+    limit: int = Query(50, ge=1, le=100),
+    current_user: User = Depends(auth.get_current_user)
+):
+    return await list_conversations(current_user.id, before, limit)
+
+@app.get("/conversations/{conversation_id}/messages", response_model=MessagePage)
+async def get_conversation_messages(
+    conversation_id: str,
+    before: Optional[int] = Query(None, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: User = Depends(auth.get_current_user)
+):
+    page = await get_messages_page(conversation_id, current_user.id, before, limit)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    return page
 
 @app.post("/conversations/new")
 async def create_conversation(current_user: User = Depends(auth.get_current_user)):
     title = f"Conversación {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    new_conv = Conversation(title=title)
+    new_conv = Conversation(title=title, owner_id=current_user.id)
     await new_conv.insert()
     
-    current_user.conversations.append(new_conv)
-    await current_user.save()
-    
     return {"conversation_id": str(new_conv.id), "title": title}
 
 @app.delete("/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str, current_user: User = Depends(auth.get_current_user)):
-    conversation = await Conversation.get(conversation_id)
-    if not conversation:
+    if not await delete_conversation_by_id(conversation_id, current_user.id):
         raise HTTPException(status_code=404, detail="Conversación no encontrada")
-    
-    await conversation.delete()
-    current_user.conversations = [conv for conv in current_user.conversations if str(conv.id) != conversation_id]
-    await current_user.save()
+    board_states.pop(board_state_key(current_user.id, conversation_id))
     
     return {"message": "Conversación eliminada"}
 
-@app.post("/calculate", status_code=status.HTTP_200_OK)
-async def calculate(
-    req: CalculateRequest,
-    current_user: User = Depends(auth.get_current_user)
-):
-    print(f"Cálculo de pizarra solicitado por el usuario: {current_user.email}")
+def check_whiteboard(image_data: bytes, content_type: str):
+    if len(image_data) > WHITEBOARD_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"La imagen supera los {WHITEBOARD_MAX_BYTES} bytes")
+    if content_type not in WHITEBOARD_CONTENT_TYPES:
+        raise HTTPException(status_code=415, detail="Formato de imagen no soportado, usa PNG, WebP o JPEG")
+
+async def process_whiteboard(
+    owner_id: UUID,
+    image_data: bytes,
+    content_type: str,
+    dict_of_vars: dict,
+    conversation_id: Optional[str],
+    job_id: Optional[str] = None
+) -> dict:
+    check_whiteboard(image_data, content_type)
+    # Antes de gastar la llamada a Gemini y guardar la imagen.
+    if conversation_id and not await owns_conversation(conversation_id, owner_id):
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+
+    previous_state = board_states.get(board_state_key(owner_id, conversation_id)) if conversation_id else None
     try:
-        result = analyze_image(req.image, req.dict_of_vars)
-        
-        if req.conversation_id:
-            conversation = await Conversation.get(req.conversation_id)
-            if not conversation:
-                raise HTTPException(status_code=404, detail="Conversación no encontrada")
-        else:
-            conversation = Conversation(title=f"Sesión {datetime.now().strftime('%Y-%m-%d %H:%M')}")
-            await conversation.insert()
-            current_user.conversations.append(conversation)
-            await current_user.save()
-        
-        conversation.messages.append(ChatMessage(
+        result, board_state = await analyze_board(image_data, dict_of_vars, previous_state)
+    except UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="No se pudo leer la imagen de la pizarra")
+
+    image_id = await store_image_data(image_data, content_type)
+    results_text = ", ".join([f"{r['expr']} = {r['result']}" for r in result if isinstance(r, dict) and 'expr' in r])
+    messages = [
+        ChatMessage(
             sender="user",
             text="[Analicé contenido de la pizarra]",
-            image_base64=req.image,
+            image_id=image_id,
             analysis_result=result,
-            message_type="whiteboard"
-        ))
-        
-        results_text = ", ".join([f"{r.expr} = {r.result}" for r in result if hasattr(r, 'expr')])
-        conversation.messages.append(ChatMessage(
+            message_type="whiteboard",
+            job_id=job_id
+        ),
+        ChatMessage(
             sender="ai",
             text=f"Detecté en la pizarra: {results_text}",
-            message_type="system"
-        ))
-        
-        await conversation.save()
+            message_type="system",
+            job_id=job_id
+        )
+    ]
 
-        response_data = {
-            "status": "success",
-            "data": result,
-            "conversation_id": str(conversation.id)
-        }
-        return response_data
+    if conversation_id:
+        if not await append_messages(conversation_id, owner_id, messages, job_id):
+            # La conversación se borró durante el análisis.
+            await delete_unreferenced_images({image_id})
+            raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    else:
+        conversation = Conversation(
+            title=f"Sesión {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+            owner_id=owner_id,
+            messages=messages,
+            message_count=len(messages)
+        )
+        if job_id is not None:
+            # La conversación de un trabajo toma su id: un reintento no crea otra.
+            conversation.id = PydanticObjectId(job_id)
+        try:
+            await conversation.insert()
+        except DuplicateKeyError:
+            if job_id is None:
+                raise
+        conversation_id = str(conversation.id)
+
+    if board_state is not None:
+        board_states.set(board_state_key(owner_id, conversation_id), board_state)
+
+    return {
+        "status": "success",
+        "data": result,
+        "conversation_id": conversation_id
+    }
+
+async def run_calculation(current_user: User, image_data: bytes, content_type: str, dict_of_vars: dict, conversation_id: Optional[str]) -> dict:
+    print(f"Cálculo de pizarra solicitado por el usuario: {current_user.email}")
+    try:
+        return await process_whiteboard(current_user.id, image_data, content_type, dict_of_vars, conversation_id)
+    except HTTPException:
+        raise
+    except ServiceBusyError as e:
+        raise busy_exception(e)
     except Exception as e:
         print(f"Error en /calculate: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/calculate", status_code=status.HTTP_200_OK)
+async def calculate(
+    req: CalculateRequest,
+    current_user: User = Depends(auth.get_current_user)
+):
+    try:
+        with image_stage_duration.time(stage="decode"):
+            image_data, declared_type = decode_data_url(req.image)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="La imagen no es un base64 válido")
+    content_type = sniff_content_type(image_data) or declared_type
+    return await run_calculation(current_user, image_data, content_type, req.dict_of_vars, req.conversation_id)
+
+def parse_vars(raw: Optional[str]) -> dict:
+    if not raw:
+        return {}
+    try:
+        value = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="dict_of_vars debe ser un objeto JSON")
+    if not isinstance(value, dict):
+        raise HTTPException(status_code=400, detail="dict_of_vars debe ser un objeto JSON")
+    return value
+
+# Variante sin base64: multipart/form-data con el archivo en el campo "image",
+# o el PNG/WebP crudo como cuerpo con los demás datos en la query.
+@app.post("/calculate/upload", status_code=status.HTTP_200_OK)
+async def calculate_upload(
+    request: Request,
+    dict_of_vars: Optional[str] = Query(None),
+    conversation_id: Optional[str] = Query(None),
+    current_user: User = Depends(auth.get_current_user)
+):
+    request_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if request_type == "multipart/form-data":
+        form = await request.form(max_files=1)
+        upload = form.get("image")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Falta el archivo 'image'")
+        image_data = await upload.read(WHITEBOARD_MAX_BYTES + 1)
+        content_type = sniff_content_type(image_data) or upload.content_type
+        dict_of_vars = form.get("dict_of_vars") or dict_of_vars
+        conversation_id = form.get("conversation_id") or conversation_id
+    else:
+        image_data = await read_limited_body(request, WHITEBOARD_MAX_BYTES + 1)
+        content_type = sniff_content_type(image_data) or request_type
+
+    return await run_calculation(current_user, image_data, content_type, parse_vars(dict_of_vars), conversation_id)
+
+async def read_limited_body(request: Request, limit: int) -> bytes:
+    body = bytearray()
+    async for chunk in request.stream():
+        body.extend(chunk)
+        if len(body) >= limit:
+            break
+    return bytes(body)
+
+@app.websocket("/ws/calculate")
+async def calculate_socket(websocket: WebSocket, token: Optional[str] = Query(None)):
+    try:
+        current_user = await auth.get_current_user(token or "")
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    conversation_id = websocket.query_params.get("conversation_id")
+    dict_of_vars = {}
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+
+            if message.get("text") is not None:
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    control = None
+                if not isinstance(control, dict):
+                    await websocket.send_json({"type": "error", "status": 400, "detail": "Mensaje de control inválido"})
+                elif control.get("type") == "ping":
+                    await websocket.send_json({"type": "pong"})
+                else:
+                    conversation_id = control.get("conversation_id", conversation_id)
+                    dict_of_vars = control.get("dict_of_vars", dict_of_vars) or {}
+                    await websocket.send_json({"type": "config", "conversation_id": conversation_id})
+                continue
+
+            image_data = message.get("bytes") or b""
+            try:
+                response_data = await run_calculation(
+                    current_user, image_data, sniff_content_type(image_data) or "", dict_of_vars, conversation_id
+                )
+            except HTTPException as e:
+                await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+                continue
+            # La primera pizarra crea la conversación y las siguientes se agregan a ella.
+            conversation_id = response_data["conversation_id"]
+            await websocket.send_json({"type": "result", **response_data})
+    except WebSocketDisconnect:
+        pass
+
+async def run_whiteboard_job(job: CalculationJob) -> dict:
+    image = await get_image(job.image_id)
+    if image is None:
+        raise JobFailed(404, "La imagen del trabajo ya no existe")
+    try:
+        return await process_whiteboard(
+            job.owner_id, image.data, job.content_type, job.dict_of_vars, job.conversation_id, str(job.id)
+        )
+    except HTTPException as e:
+        raise JobFailed(e.status_code, e.detail)
+
+# Variante asíncrona de /calculate: responde al instante con el id del trabajo y
+# el resultado se consulta en /calculate/jobs/{job_id} o se espera por SSE.
+@app.post("/calculate/jobs", response_model=CalculationJobRead, status_code=status.HTTP_202_ACCEPTED)
+async def create_calculation_job(
+    req: CalculateJobRequest,
+    current_user: User = Depends(auth.get_current_user)
+):
+    try:
+        with image_stage_duration.time(stage="decode"):
+            image_data, declared_type = decode_data_url(req.image)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="La imagen no es un base64 válido")
+    content_type = sniff_content_type(image_data) or declared_type
+    check_whiteboard(image_data, content_type)
+    if req.conversation_id and not await owns_conversation(req.conversation_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+
+    job = CalculationJob(
+        owner_id=current_user.id,
+        priority=req.priority,
+        image_id=await store_image_data(image_data, content_type),
+        content_type=content_type,
+        dict_of_vars=req.dict_of_vars,
+        conversation_id=req.conversation_id
+    )
+    try:
+        await job_queue.submit(job)
+    except ServiceBusyError as e:
+        # El trabajo no se insertó: la imagen queda sin referencias.
+        await delete_unreferenced_images({job.image_id})
+        raise busy_exception(e, retry_after=JOB_POLL_INTERVAL * 5)
+    return job_read(job)
+
+@app.get("/calculate/jobs/stats")
+async def calculation_job_stats(current_user: User = Depends(auth.get_current_user)):
+    return job_queue.stats()
+
+@app.get("/calculate/jobs/{job_id}", response_model=CalculationJobRead)
+async def get_calculation_job(job_id: str, current_user: User = Depends(auth.get_current_user)):
+    job = await job_queue.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job_read(job)
+
+@app.get("/calculate/jobs/{job_id}/events")
+async def calculation_job_events(job_id: str, current_user: User = Depends(auth.get_current_user)):
+    job = await job_queue.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    async def event_stream():
+        current = job
+        last_seen = None
+        while True:
+            data = job_read(current).model_dump(mode="json")
+            if (current.status, current.attempts) != last_seen:
+                last_seen = (current.status, current.attempts)
+                yield sse_event(current.status if current.status in FINISHED else "status", data)
+            if current.status in FINISHED:
+                break
+            await job_queue.wait(job_id, timeout=JOB_POLL_INTERVAL * 5)
+            current = await job_queue.get(job_id, current_user.id)
+            if current is None:
+                yield sse_event("error", {"status": status.HTTP_404_NOT_FOUND, "detail": "Trabajo no encontrado"})
+                break
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/images/{image_id}")
+async def read_image(image_id: str, request: Request, current_user: User = Depends(auth.get_current_user)):
+    if not await owns_image(image_id, current_user.id):
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+
+    etag = f'"{image_id}"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    image = await get_image(image_id)
+    if not image:
+        raise HTTPException(status_code=404, detail="Imagen no encontrada")
+    return Response(content=image.data, media_type=image.content_type, headers=headers)
+
+@app.get("/exercises", response_model=Ejercicio)
+async def get_exercise(
+    tema: str = "lineal",
+    dificultad: int = Query(1, ge=1, le=3),
+    current_user: User = Depends(auth.get_current_user)
+):
+    try:
+        return obtener_ejercicio(tema, dificultad)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Los ejercicios entregados se recuerdan por id (EXERCISE_INDEX_TTL) para poder
+# volver a mostrarlos y corregir la respuesta del estudiante.
+@app.get("/exercises/{ejercicio_id}", response_model=Ejercicio)
+async def get_exercise_by_id(ejercicio_id: str, current_user: User = Depends(auth.get_current_user)):
+    ejercicio = buscar_ejercicio(ejercicio_id)
+    if ejercicio is None:
+        raise HTTPException(status_code=404, detail="Ejercicio no encontrado o expirado")
+    return ejercicio
+
+@app.post("/exercises/{ejercicio_id}/check", response_model=ResultadoRespuesta)
+async def check_exercise(
+    ejercicio_id: str,
+    respuesta: RespuestaEjercicio,
+    current_user: User = Depends(auth.get_current_user)
+):
+    ejercicio = buscar_ejercicio(ejercicio_id)
+    if ejercicio is None:
+        raise HTTPException(status_code=404, detail="Ejercicio no encontrado o expirado")
+    return ResultadoRespuesta(
+        correcta=verificar_respuesta(ejercicio, respuesta.respuestas),
+        soluciones=ejercicio.soluciones
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/tools/stats")
+async def get_tool_stats(current_user: User = Depends(auth.get_current_user)):
+    return tool_executor.stats()
+
+async def conversation_history(req: ChatRequest, current_user: User) -> List[dict]:
+    if not req.conversation_id:
+        return [msg.model_dump() for msg in req.history]
+    history = await build_chat_history(req.conversation_id, current_user.id)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Conversación no encontrada")
+    return history
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat_handler(
     req: ChatRequest,
     current_user: User = Depends(auth.get_current_user)
 ):
     try:
-        response_text = await get_tutor_response(req.message, [msg.model_dump() for msg in req.history])
+        history = await conversation_history(req, current_user)
+        response_text = await get_tutor_response(req.message, history, req.bypass_cache)
         
         if req.conversation_id:
-            conversation = await Conversation.get(req.conversation_id)
-            if conversation:
-                conversation.messages.append(ChatMessage(sender="user", text=req.message))
-                conversation.messages.append(ChatMessage(sender="ai", text=response_text))
-                await conversation.save()
+            await append_messages(req.conversation_id, current_user.id, [
+                ChatMessage(sender="user", text=req.message),
+                ChatMessage(sender="ai", text=response_text)
+            ])
         
         return ChatResponse(
             status="success",
             response=response_text,
             conversation_id=req.conversation_id
         )
+    except HTTPException:
+        raise
+    except ServiceBusyError as e:
+        raise busy_exception(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_handler(
+    req: ChatRequest,
+    current_user: User = Depends(auth.get_current_user)
+):
+    history = await conversation_history(req, current_user)
+
+    async def event_stream():
+        try:
+            async for event, data in stream_tutor_response(req.message, history, req.bypass_cache):
+                if event == "done":
+                    if req.conversation_id:
+                        await append_messages(req.conversation_id, current_user.id, [
+                            ChatMessage(sender="user", text=req.message),
+                            ChatMessage(sender="ai", text=data["text"])
+                        ])
+                    data = {**data, "conversation_id": req.conversation_id}
+                yield sse_event(event, data)
+        except ServiceBusyError as e:
+            yield sse_event("error", {"status": status.HTTP_503_SERVICE_UNAVAILABLE, "detail": str(e)})
+        except Exception as e:
+            print(f"Error en /chat/stream: {e}")
+            yield sse_event("error", {"status": status.HTTP_500_INTERNAL_SERVER_ERROR, "detail": str(e)})
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/")
 def read_root():
     return {
@@ -185,7 +614,14 @@ def read_root():
         "endpoints": {
             "api": "/",
             "chat": "/chat",
+            "chat_stream": "/chat/stream",
             "calculate": "/calculate",
+            "calculate_upload": "/calculate/upload",
+            "calculate_ws": "/ws/calculate",
+            "calculate_jobs": "/calculate/jobs",
+            "exercises": "/exercises",
+            "tool_stats": "/tools/stats",
+            "metrics": "/metrics",
             "mcp": "/mcp",
             "auth": "/token"
         }
@@ -194,102 +630,69 @@ def read_root():
 @app.post("/mcp")
 async def mcp_handler(request: Request):
     try:
-        body = await request.json()
-        method = body.get("method")
-        
-        if method == "initialize":
-            return {
-                "jsonrpc": "2.0",
-                "result": {
-                    "protocolVersion": "2024-11-05",
-                    "capabilities": {"tools": {}, "resources": {}, "prompts": {}},
-                    "serverInfo": {"name": "Tutor de Matemáticas", "version": "1.0.0"}
-                },
-                "id": body.get("id")
-            }
-        elif method == "tools/list":
-            tools = []
-            for tool_name, metadata in TOOLS_METADATA.items():
-                tools.append(metadata)
-            return {
-                "jsonrpc": "2.0",
-                "result": {"tools": tools},
-                "id": body.get("id")
-            }
-        elif method == "tools/call":
-            params = body.get("params", {})
-            tool_name = params.get("name")
-            arguments = params.get("arguments", {})
-            
-            if tool_name not in TOOLS_FUNCTIONS:
-                return {
-                    "jsonrpc": "2.0",
-                    "error": {
-                        "code": -32602,
-                        "message": f"Herramienta no encontrada: {tool_name}"
-                    },
-                    "id": body.get("id")
-                }
-            
-            try:
-                tool_function = TOOLS_FUNCTIONS[tool_name]
-                result = tool_function(**arguments)
-                
-                return {
-                    "jsonrpc": "2.0",
-                    "result": {
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": str(result)
-                            }
-                        ]
-                    },
-                    "id": body.get("id")
-                }
-            except ValueError as e:
-                return {
-                    "jsonrpc": "2.0",
-                    "error": {
-                        "code": -32602,
-                        "message": f"Error de validación: {str(e)}"
-                    },
-                    "id": body.get("id")
-                }
-            except Exception as e:
-                return {
-                    "jsonrpc": "2.0",
-                    "error": {
-                        "code": -32603,
-                        "message": f"Error al ejecutar herramienta: {str(e)}"
-                    },
-                    "id": body.get("id")
-                }
-        else:
-            return JSONResponse(
-                status_code=400,
-                content={
-                    "jsonrpc": "2.0",
-                    "error": {
-                        "code": -32601,
-                        "message": f"Método no soportado: {method}"
-                    },
-                    "id": body.get("id")
-                }
-            )
+        payload = await request.json()
+    except ValueError:
+        return JSONResponse(status_code=400, content=rpc_error(None, PARSE_ERROR, "El cuerpo no es JSON válido"))
+
+    session_id = request.headers.get("mcp-session-id")
+    if session_id and get_session(session_id) is None:
+        return JSONResponse(
+            status_code=404,
+            content=rpc_error(None, INVALID_REQUEST, "Sesión MCP no encontrada o expirada")
+        )
+
+    if (
+        isinstance(payload, list) and payload
+        and "text/event-stream" in request.headers.get("accept", "")
+        and not any(isinstance(message, dict) and message.get("method") == "initialize" for message in payload)
+    ):
+        return StreamingResponse(
+            stream_payload(payload),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+
+    try:
+        response, session = await handle_payload(payload)
     except Exception as e:
         return JSONResponse(
             status_code=500,
-            content={
-                "jsonrpc": "2.0",
-                "error": {
-                    "code": -32603,
-                    "message": f"Error interno del servidor: {str(e)}"
-                },
-                "id": body.get("id", None)
-            }
+            content=rpc_error(
+                payload.get("id") if isinstance(payload, dict) else None,
+                INTERNAL_ERROR,
+                f"Error interno del servidor: {str(e)}"
+            )
         )
 
+    if response is None:
+        return Response(status_code=status.HTTP_202_ACCEPTED)
+
+    status_code = 200
+    if isinstance(response, dict) and response.get("error", {}).get("code") in (METHOD_NOT_FOUND, INVALID_REQUEST):
+        status_code = 400
+    headers = {"Mcp-Session-Id": session.id} if session else {}
+    return JSONResponse(status_code=status_code, content=response, headers=headers)
+
+@app.get("/mcp")
+async def mcp_session_stream(request: Request):
+    session = get_session(request.headers.get("mcp-session-id", ""))
+    if session is None:
+        return JSONResponse(
+            status_code=404,
+            content=rpc_error(None, INVALID_REQUEST, "Sesión MCP no encontrada o expirada")
+        )
+    return StreamingResponse(
+        session_stream(session),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Mcp-Session-Id": session.id}
+    )
+
+@app.delete("/mcp")
+async def mcp_close_session(request: Request):
+    if not close_session(request.headers.get("mcp-session-id", "")):
+        raise HTTPException(status_code=404, detail="Sesión MCP no encontrada")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main:app", host="localhost", port=3000, reload=True)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import os
+import json
+import asyncio
+import inspect
+from typing import Optional
+from uuid import uuid4
+from fastapi.encoders import jsonable_encoder
+
+from cache import CountingCache
+from mcp_tools import TOOLS_METADATA, TOOLS_FUNCTIONS
+from tool_executor import tool_executor
+
+MCP_SESSION_TTL = int(os.getenv("MCP_SESSION_TTL", "3600"))
+MCP_MAX_SESSIONS = int(os.getenv("MCP_MAX_SESSIONS", "1000"))
+MCP_KEEPALIVE_SECONDS = float(os.getenv("MCP_KEEPALIVE_SECONDS", "15"))
+
+SUPPORTED_PROTOCOL_VERSIONS = ("2025-03-26", "2024-11-05")
+SERVER_INFO = {"name": "Tutor de Matemáticas", "version": "1.0.0"}
+CAPABILITIES = {"tools": {}, "resources": {}, "prompts": {}}
+TOOLS_LIST_RESULT = {"tools": list(TOOLS_METADATA.values())}
+
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+
+class McpSession:
+    def __init__(self, protocol_version: str):
+        self.id = uuid4().hex
+        self.protocol_version = protocol_version
+
+sessions = CountingCache(maxsize=MCP_MAX_SESSIONS, ttl=MCP_SESSION_TTL)
+
+def create_session(protocol_version: str) -> McpSession:
+    session = McpSession(protocol_version)
+    sessions.set(session.id, session)
+    return session
+
+def get_session(session_id: str) -> Optional[McpSession]:
+    session = sessions.get(session_id)
+    if session is not None:
+        sessions.set(session_id, session)
+    return session
+
+def close_session(session_id: str) -> bool:
+    if session_id not in sessions:
+        return False
+    sessions.pop(session_id)
+    return True
+
+def rpc_result(message_id, result: dict) -> dict:
+    return {"jsonrpc": "2.0", "result": result, "id": message_id}
+
+def rpc_error(message_id, code: int, message: str) -> dict:
+    return {"jsonrpc": "2.0", "error": {"code": code, "message": message}, "id": message_id}
+
+def is_notification(message) -> bool:
+    return isinstance(message, dict) and "method" in message and "id" not in message
+
+def negotiate_version(requested: Optional[str]) -> str:
+    return requested if requested in SUPPORTED_PROTOCOL_VERSIONS else SUPPORTED_PROTOCOL_VERSIONS[0]
+
+async def call_tool(message_id, params: dict) -> dict:
+    tool_name = params.get("name")
+    arguments = params.get("arguments") or {}
+
+    if tool_name not in TOOLS_FUNCTIONS:
+        return rpc_error(message_id, INVALID_PARAMS, f"Herramienta no encontrada: {tool_name}")
+    if not isinstance(arguments, dict):
+        return rpc_error(message_id, INVALID_PARAMS, "Los argumentos deben ser un objeto")
+    try:
+        inspect.signature(TOOLS_FUNCTIONS[tool_name]).bind(**arguments)
+    except TypeError as e:
+        return rpc_error(message_id, INVALID_PARAMS, f"Argumentos inválidos: {str(e)}")
+
+    try:
+        result = await tool_executor.run(tool_name, arguments)
+    except (TypeError, ValueError) as e:
+        return rpc_error(message_id, INVALID_PARAMS, f"Error de validación: {str(e)}")
+    except Exception as e:
+        return rpc_error(message_id, INTERNAL_ERROR, f"Error al ejecutar herramienta: {str(e)}")
+
+    structured = jsonable_encoder(result)
+    return rpc_result(message_id, {
+        "content": [
+            {
+                "type": "text",
+                "text": json.dumps(structured, ensure_ascii=False)
+            }
+        ],
+        "structuredContent": structured,
+        "isError": False
+    })
+
+async def handle_message(message) -> tuple[Optional[dict], Optional[McpSession]]:
+    if not isinstance(message, dict) or not isinstance(message.get("method"), str):
+        message_id = message.get("id") if isinstance(message, dict) else None
+        return rpc_error(message_id, INVALID_REQUEST, "Petición JSON-RPC inválida"), None
+
+    method = message["method"]
+    message_id = message.get("id")
+    params = message.get("params") or {}
+
+    if is_notification(message):
+        return None, None
+
+    if method == "initialize":
+        session = create_session(negotiate_version(params.get("protocolVersion")))
+        return rpc_result(message_id, {
+            "protocolVersion": session.protocol_version,
+            "capabilities": CAPABILITIES,
+            "serverInfo": SERVER_INFO
+        }), session
+    if method == "ping":
+        return rpc_result(message_id, {}), None
+    if method == "tools/list":
+        return rpc_result(message_id, TOOLS_LIST_RESULT), None
+    if method == "tools/call":
+        return await call_tool(message_id, params), None
+    return rpc_error(message_id, METHOD_NOT_FOUND, f"Método no soportado: {method}"), None
+
+async def handle_payload(payload) -> tuple[Optional[object], Optional[McpSession]]:
+    if not isinstance(payload, list):
+        return await handle_message(payload)
+    if not payload:
+        return rpc_error(None, INVALID_REQUEST, "El lote JSON-RPC está vacío"), None
+
+    outcomes = await asyncio.gather(*[handle_message(message) for message in payload])
+    responses = [response for response, _ in outcomes if response is not None]
+    session = next((session for _, session in outcomes if session is not None), None)
+    return responses or None, session
+
+async def stream_payload(payload: list):
+    tasks = [asyncio.create_task(handle_message(message)) for message in payload]
+    try:
+        for task in asyncio.as_completed(tasks):
+            response, _ = await task
+            if response is not None:
+                yield sse_message(response)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def sse_message(message: dict) -> str:
+    return f"event: message\ndata: {json.dumps(message, ensure_ascii=False)}\n\n"
+
+# El servidor no inicia mensajes (no hay notificaciones ni peticiones al
+# cliente): el stream de GET /mcp sólo mantiene viva la conexión y termina
+# cuando la sesión se cierra o expira.
+async def session_stream(session: McpSession):
+    # Sin get_session: el stream abierto no renueva la sesión ni cuenta aciertos.
+    while session.id in sessions:
+        yield ": keepalive\n\n"
+        await asyncio.sleep(MCP_KEEPALIVE_SECONDS)
@@ -1,8 +1,10 @@
 from pydantic import BaseModel, Field
 from enum import Enum
 import math
-import re
-from typing import List
+import numpy as np
+from typing import List, Optional
+
+from expression_engine import compile_expression, ExpressionError
 
 class TipoEcuacion(str, Enum):
     lineal = "lineal"
@@ -31,6 +33,31 @@ class ResultadoOperacion(BaseModel):
     resultado: float = Field(description="Resultado numérico de la operación")
     pasos: List[str] = Field(description="Explicación paso a paso del cálculo")
 
+class TablaDeValores(BaseModel):
+    expresion: str = Field(description="Expresión evaluada")
+    variable: str = Field(description="Variable que recorre los valores")
+    valores: List[float] = Field(description="Valores de la variable")
+    resultados: List[Optional[float]] = Field(description="Resultado para cada valor (null si no está definido)")
+
+class LoteLineal(BaseModel):
+    tipo: TipoEcuacion = Field(default=TipoEcuacion.lineal)
+    cantidad: int = Field(description="Cantidad de ecuaciones resueltas")
+    soluciones: List[Optional[float]] = Field(description="Solución de cada ecuación (null si m = 0)")
+    validas: List[bool] = Field(description="Si cada ecuación tiene solución única")
+    pasos: Optional[List[List[str]]] = Field(default=None, description="Pasos de cada ecuación, sólo si se piden")
+
+class LoteCuadratico(BaseModel):
+    tipo: TipoEcuacion = Field(default=TipoEcuacion.cuadratica)
+    cantidad: int = Field(description="Cantidad de ecuaciones resueltas")
+    discriminantes: List[Optional[float]] = Field(description="Discriminante de cada ecuación (null si a = 0)")
+    x1: List[Optional[float]] = Field(description="Primera solución real (null si no hay)")
+    x2: List[Optional[float]] = Field(description="Segunda solución real (null si no hay o es doble)")
+    num_soluciones: List[Optional[int]] = Field(description="Cantidad de soluciones reales (null si a = 0)")
+    pasos: Optional[List[List[str]]] = Field(default=None, description="Pasos de cada ecuación, sólo si se piden")
+
+TABLA_MAX_PUNTOS = 1000
+LOTE_MAX_ECUACIONES = 10000
+
 def resolver_ecuacion_lineal(m: float, b: float) -> dict:
     if m == 0:
         raise ValueError("El coeficiente 'm' no puede ser cero")
@@ -104,29 +131,14 @@ def resolver_ecuacion_cuadratica(a: float, b: float, c: float) -> dict:
 
 def realizar_operacion(expresion: str) -> dict:
     expresion_original = expresion
-    expresion = expresion.strip().replace(" ", "")
+    expresion = expresion.strip()
     
-    caracteres_permitidos = re.compile(r'^[0-9+\-*/().^a-z,]+$', re.IGNORECASE)
-    if not caracteres_permitidos.match(expresion):
-        raise ValueError(f"Caracteres no permitidos en: '{expresion}'")
-    
-    expresion_eval = expresion.replace("^", "**")
-    namespace_seguro = {
-        "sqrt": math.sqrt,
-        "sin": math.sin,
-        "cos": math.cos,
-        "tan": math.tan,
-        "log": math.log10,
-        "pi": math.pi,
-        "e": math.e,
-        "__builtins__": {}
-    }
-    
-    resultado = eval(expresion_eval, namespace_seguro)
+    compilada = compile_expression(expresion)
+    resultado = compilada.evaluate()
     
     pasos = [
         f"Expresión: {expresion_original}",
-        f"Procesada: {expresion_eval}",
+        f"Procesada: {expresion.replace('^', '**')}",
         f"Resultado: {resultado:.6f}"
     ]
     
@@ -138,6 +150,95 @@ def realizar_operacion(expresion: str) -> dict:
     
     return resultado_obj.model_dump()
 
+def tabla_de_valores(expresion: str, desde: float, hasta: float, paso: float = 1, variable: str = "x") -> dict:
+    if paso <= 0:
+        raise ValueError("El paso debe ser mayor que cero")
+    if hasta < desde:
+        raise ValueError("'hasta' debe ser mayor o igual que 'desde'")
+    cantidad = int(math.floor((hasta - desde) / paso + 1e-9)) + 1
+    if cantidad > TABLA_MAX_PUNTOS:
+        raise ValueError(f"La tabla no puede tener más de {TABLA_MAX_PUNTOS} valores")
+
+    compilada = compile_expression(expresion.strip())
+    extra = compilada.variables - {variable}
+    if extra:
+        raise ExpressionError(f"Variables sin valor: {', '.join(sorted(extra))}")
+
+    valores = [round(desde + i * paso, 10) for i in range(cantidad)]
+    resultados = compilada.evaluate_many({variable: valor} for valor in valores)
+
+    resultado = TablaDeValores(
+        expresion=expresion,
+        variable=variable,
+        valores=valores,
+        resultados=resultados
+    )
+    return resultado.model_dump()
+
+def coeficientes_lote(**columnas) -> list:
+    arrays = [np.asarray(list(valores), dtype=float) for valores in columnas.values()]
+    cantidad = len(arrays[0])
+    if any(array.ndim != 1 or len(array) != cantidad for array in arrays):
+        raise ValueError(f"Las listas {', '.join(columnas)} deben tener la misma longitud")
+    if cantidad > LOTE_MAX_ECUACIONES:
+        raise ValueError(f"El lote no puede tener más de {LOTE_MAX_ECUACIONES} ecuaciones")
+    return arrays
+
+def columna(valores: np.ndarray, mascara: np.ndarray) -> list:
+    return [float(valor) if ok else None for valor, ok in zip(valores.tolist(), mascara.tolist())]
+
+def resolver_lote_lineal(m: List[float], b: List[float], incluir_pasos: bool = False) -> dict:
+    m_arr, b_arr = coeficientes_lote(m=m, b=b)
+    validas = m_arr != 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        soluciones = np.where(validas, -b_arr / m_arr, np.nan)
+
+    pasos = None
+    if incluir_pasos:
+        pasos = [
+            resolver_ecuacion_lineal(mi, bi)["pasos"] if ok else ["El coeficiente 'm' no puede ser cero"]
+            for mi, bi, ok in zip(m_arr.tolist(), b_arr.tolist(), validas.tolist())
+        ]
+
+    resultado = LoteLineal(
+        cantidad=len(m_arr),
+        soluciones=columna(soluciones, validas),
+        validas=validas.tolist(),
+        pasos=pasos
+    )
+    return resultado.model_dump()
+
+def resolver_lote_cuadratico(a: List[float], b: List[float], c: List[float], incluir_pasos: bool = False) -> dict:
+    a_arr, b_arr, c_arr = coeficientes_lote(a=a, b=b, c=c)
+    validas = a_arr != 0
+    discriminantes = b_arr**2 - 4 * a_arr * c_arr
+    raiz = np.sqrt(np.where(discriminantes >= 0, discriminantes, 0))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x1 = (-b_arr + raiz) / (2 * a_arr)
+        x2 = (-b_arr - raiz) / (2 * a_arr)
+    num_soluciones = np.select([discriminantes > 0, discriminantes == 0], [2, 1], 0)
+
+    pasos = None
+    if incluir_pasos:
+        pasos = [
+            resolver_ecuacion_cuadratica(ai, bi, ci)["pasos"] if ok else ["El coeficiente 'a' no puede ser cero"]
+            for ai, bi, ci, ok in zip(a_arr.tolist(), b_arr.tolist(), c_arr.tolist(), validas.tolist())
+        ]
+
+    resultado = LoteCuadratico(
+        cantidad=len(a_arr),
+        discriminantes=columna(discriminantes, validas),
+        x1=columna(x1, validas & (num_soluciones > 0)),
+        x2=columna(x2, validas & (num_soluciones == 2)),
+        num_soluciones=[int(n) if ok else None for n, ok in zip(num_soluciones.tolist(), validas.tolist())],
+        pasos=pasos
+    )
+    return resultado.model_dump()
+
+def generar_ejercicio(tema: str = "lineal", dificultad: int = 1) -> dict:
+    from exercise_bank import obtener_ejercicio
+    return obtener_ejercicio(tema, dificultad).model_dump()
+
 TOOLS_METADATA = {
     "resolver_ecuacion_lineal": {
         "name": "resolver_ecuacion_lineal",
@@ -174,11 +275,69 @@ TOOLS_METADATA = {
             },
             "required": ["expresion"]
         }
+    },
+    "tabla_de_valores": {
+        "name": "tabla_de_valores",
+        "description": "Evalúa una expresión con una variable para un rango de valores (tabla de valores para graficar)",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "expresion": {"type": "string", "description": "Expresión en función de la variable, por ejemplo 2x^2 - 3"},
+                "desde": {"type": "number", "description": "Primer valor de la variable"},
+                "hasta": {"type": "number", "description": "Último valor de la variable"},
+                "paso": {"type": "number", "description": "Incremento entre valores (por defecto 1)"},
+                "variable": {"type": "string", "description": "Nombre de la variable (por defecto x)"}
+            },
+            "required": ["expresion", "desde", "hasta"]
+        }
+    },
+    "resolver_lote_lineal": {
+        "name": "resolver_lote_lineal",
+        "description": "Resuelve de una vez muchas ecuaciones lineales mx + b = 0 (por ejemplo una guía de ejercicios)",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "m": {"type": "array", "items": {"type": "number"}, "description": "Coeficientes de x, uno por ecuación"},
+                "b": {"type": "array", "items": {"type": "number"}, "description": "Términos independientes, uno por ecuación"},
+                "incluir_pasos": {"type": "boolean", "description": "Si se devuelven los pasos de cada ecuación (por defecto false)"}
+            },
+            "required": ["m", "b"]
+        }
+    },
+    "resolver_lote_cuadratico": {
+        "name": "resolver_lote_cuadratico",
+        "description": "Resuelve de una vez muchas ecuaciones cuadráticas ax² + bx + c = 0 (por ejemplo una guía de ejercicios)",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "a": {"type": "array", "items": {"type": "number"}, "description": "Coeficientes cuadráticos, uno por ecuación"},
+                "b": {"type": "array", "items": {"type": "number"}, "description": "Coeficientes lineales, uno por ecuación"},
+                "c": {"type": "array", "items": {"type": "number"}, "description": "Términos independientes, uno por ecuación"},
+                "incluir_pasos": {"type": "boolean", "description": "Si se devuelven los pasos de cada ecuación (por defecto false)"}
+            },
+            "required": ["a", "b", "c"]
+        }
+    },
+    "generar_ejercicio": {
+        "name": "generar_ejercicio",
+        "description": "Devuelve un ejercicio de práctica nuevo, con su solución ya verificada, para que el estudiante lo resuelva en la pizarra",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "tema": {"type": "string", "enum": ["lineal", "cuadratica"], "description": "Tipo de ecuación (por defecto lineal)"},
+                "dificultad": {"type": "integer", "description": "Nivel de dificultad: 1, 2 o 3 (por defecto 1)"}
+            },
+            "required": []
+        }
     }
 }
 
 TOOLS_FUNCTIONS = {
     "resolver_ecuacion_lineal": resolver_ecuacion_lineal,
     "resolver_ecuacion_cuadratica": resolver_ecuacion_cuadratica,
-    "realizar_operacion": realizar_operacion
+    "realizar_operacion": realizar_operacion,
+    "tabla_de_valores": tabla_de_valores,
+    "resolver_lote_lineal": resolver_lote_lineal,
+    "resolver_lote_cuadratico": resolver_lote_cuadratico,
+    "generar_ejercicio": generar_ejercicio
 }
\ No newline at end of file
@@ -0,0 +1,221 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def format_labels(labelnames: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+# Métricas en memoria del proceso. Los listeners de Mongo se ejecutan en hilos
+# del driver, por eso cada métrica protege sus valores con un lock.
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+        registry.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in items]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = format_labels(self.labelnames, key, f'le="{format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+registry: list[Metric] = []
+collectors: list = []
+
+def register_collector(collector):
+    # Un collector devuelve [(nombre, tipo, ayuda, [(labels, valor), ...])]
+    # con valores que ya existen en otros módulos (cachés, colas, contadores).
+    collectors.append(collector)
+    return collector
+
+def render_collected(name: str, kind: str, documentation: str, samples: list) -> list[str]:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        lines.append(f"{name}{format_labels(tuple(labels), tuple(labels.values()))} {format_value(value)}")
+    return lines
+
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.header())
+        lines.extend(metric.render())
+    for collector in collectors:
+        for name, kind, documentation, samples in collector():
+            lines.extend(render_collected(name, kind, documentation, samples))
+    return "\n".join(lines) + "\n"
+
+http_requests = Counter("http_requests_total", "Peticiones HTTP atendidas", ("method", "route", "status"))
+http_duration = Histogram("http_request_duration_seconds", "Duración de las peticiones HTTP hasta enviar el cuerpo completo", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "Peticiones HTTP en curso")
+
+gemini_duration = Histogram(
+    "gemini_request_duration_seconds", "Duración de las llamadas a Gemini (sin la espera en la cola)", ("component",),
+    buckets=(0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+)
+gemini_requests = Counter("gemini_requests_total", "Llamadas a Gemini", ("component", "outcome"))
+gemini_tokens = Counter("gemini_tokens_total", "Tokens informados por Gemini", ("component", "kind"))
+
+mongo_duration = Histogram(
+    "mongo_command_duration_seconds", "Duración de los comandos de MongoDB", ("command",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+mongo_failures = Counter("mongo_command_failures_total", "Comandos de MongoDB que fallaron", ("command",))
+
+tool_duration = Histogram(
+    "tool_call_duration_seconds", "Duración de las llamadas a herramientas", ("tool", "mode"),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+)
+tool_calls = Counter("tool_calls_total", "Llamadas a herramientas por resultado", ("tool", "outcome"))
+
+image_stage_duration = Histogram(
+    "image_stage_duration_seconds", "Duración de cada etapa del análisis de pizarra", ("stage",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+def record_usage(component: str, response):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    for kind, field in (("prompt", "prompt_token_count"), ("candidates", "candidates_token_count")):
+        count = getattr(usage, field, 0) or 0
+        if count:
+            gemini_tokens.inc(count, component=component, kind=kind)
+
+async def timed_gemini(component: str, func, *args, **kwargs):
+    start = time.perf_counter()
+    try:
+        response = await func(*args, **kwargs)
+    except Exception:
+        gemini_requests.inc(component=component, outcome="error")
+        raise
+    finally:
+        gemini_duration.observe(time.perf_counter() - start, component=component)
+    gemini_requests.inc(component=component, outcome="ok")
+    record_usage(component, response)
+    return response
+
+class MongoCommandListener(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_duration.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        mongo_duration.observe(event.duration_micros / 1e6, command=event.command_name)
+        mongo_failures.inc(command=event.command_name)
+
+class MetricsMiddleware:
+    # Middleware ASGI puro: mide hasta el último fragmento del cuerpo, así que
+    # las respuestas en streaming cuentan su duración completa.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_in_flight.dec()
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            http_duration.observe(time.perf_counter() - start, method=method, route=path)
+            http_requests.inc(method=method, route=path, status=str(status_code))
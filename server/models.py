@@ -1,31 +1,97 @@
-from beanie import Document, Link, PydanticObjectId
+from beanie import Document, PydanticObjectId
 from pydantic import BaseModel, Field, EmailStr, field_validator
 from typing import Optional, List
 from uuid import UUID, uuid4
+from datetime import datetime, timezone
+from pymongo import IndexModel, ASCENDING, DESCENDING
 
 class ChatMessage(BaseModel):
     sender: str
     text: str
     image_base64: Optional[str] = None
+    image_id: Optional[str] = None
     analysis_result: Optional[List[dict]] = None
     message_type: str = "text"
+    job_id: Optional[str] = None
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
 
 class Conversation(Document):
     title: str
+    owner_id: Optional[UUID] = None
+    updated_at: datetime = Field(default_factory=utc_now)
     messages: List[ChatMessage] = []
+    message_count: int = 0
+    summary: str = ""
+    summary_upto: int = 0
     
     class Settings:
         name = "conversations"
+        indexes = [
+            IndexModel([("owner_id", ASCENDING), ("updated_at", DESCENDING)], name="owner_updated"),
+            IndexModel([("messages.image_id", ASCENDING)], name="message_images", sparse=True)
+        ]
 
 class User(Document):
     id: UUID = Field(default_factory=uuid4)
     name: str
     email: EmailStr = Field(unique=True, index=True)
     hashed_password: str
-    conversations: List[Link[Conversation]] = []
     
     class Settings:
         name = "users"
+        indexes = [
+            IndexModel([("email", ASCENDING)], name="email_unique", unique=True)
+        ]
+
+class ImageBlob(Document):
+    id: str
+    data: bytes
+    content_type: str
+    size: int
+
+    class Settings:
+        name = "images"
+
+class AnalysisCacheEntry(Document):
+    id: str
+    result: List[dict]
+    expires_at: datetime
+
+    class Settings:
+        name = "analysis_cache"
+        indexes = [
+            IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0)
+        ]
+
+class CalculationJob(Document):
+    owner_id: UUID
+    status: str = "queued"
+    priority: int = 0
+    image_id: str
+    content_type: str
+    dict_of_vars: dict = {}
+    conversation_id: Optional[str] = None
+    attempts: int = 0
+    max_attempts: int = 1
+    created_at: datetime = Field(default_factory=utc_now)
+    available_at: datetime = Field(default_factory=utc_now)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    result: Optional[dict] = None
+    error: Optional[dict] = None
+
+    class Settings:
+        name = "calculation_jobs"
+        indexes = [
+            IndexModel(
+                [("status", ASCENDING), ("priority", DESCENDING), ("available_at", ASCENDING)],
+                name="status_priority"
+            ),
+            IndexModel([("expires_at", ASCENDING)], name="expires_at", expireAfterSeconds=0)
+        ]
 
 class UserCreate(BaseModel):
     name: str
@@ -49,6 +115,15 @@ class UserRead(BaseModel):
 class ConversationRead(BaseModel):
     id: PydanticObjectId
     title: str
+    updated_at: Optional[datetime] = None
+
+class MessageRead(ChatMessage):
+    seq: int
+
+class MessagePage(BaseModel):
+    messages: List[MessageRead]
+    total: int
+    next_before: Optional[int] = None
 
 class Token(BaseModel):
     access_token: str
@@ -59,10 +134,25 @@ class CalculateRequest(BaseModel):
     dict_of_vars: dict = {}
     conversation_id: Optional[str] = None
 
+class CalculateJobRequest(CalculateRequest):
+    priority: int = Field(0, ge=0, le=9)
+
+class CalculationJobRead(BaseModel):
+    job_id: str
+    status: str
+    priority: int
+    attempts: int
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[dict] = None
+    error: Optional[dict] = None
+
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
     history: List[ChatMessage] = []
+    bypass_cache: bool = False
 
 class ChatResponse(BaseModel):
     status: str
@@ -0,0 +1,135 @@
+import asyncio
+import base64
+import io
+import os
+from datetime import timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+from mongomock_motor import AsyncMongoMockClient
+from PIL import Image, ImageDraw
+
+for name, value in {"GEMINI_API_KEY": "test", "SECRET_KEY": "test", "MONGO_URI": "mongodb://localhost/test"}.items():
+    os.environ.setdefault(name, value)
+
+import database
+database.AsyncIOMotorClient = lambda *args, **kwargs: AsyncMongoMockClient()
+
+import main
+from calculation_jobs import job_queue
+from fastapi import HTTPException
+from image_store import store_image_data
+from models import CalculationJob, CalculateJobRequest, Conversation, ImageBlob, User, utc_now
+
+RESULT = [{"expr": "1+1", "result": 2, "assign": False}]
+
+def board_png() -> bytes:
+    image = Image.new("RGB", (200, 100), "white")
+    ImageDraw.Draw(image).line((20, 50, 180, 50), fill="black", width=3)
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+@pytest.fixture
+def run(monkeypatch):
+    async def fake_analyze_board(image_data, dict_of_vars, previous_state=None):
+        return RESULT, None
+
+    monkeypatch.setattr(main, "analyze_board", fake_analyze_board)
+    monkeypatch.setattr(main, "print", lambda *args, **kwargs: None, raising=False)
+
+    def run_scenario(scenario):
+        async def with_database():
+            # Cada prueba arranca con una base de datos en memoria vacía.
+            await database.init_db()
+            owner = User(name="a", email="a@a.com", hashed_password="x")
+            await owner.insert()
+            return await scenario(owner)
+        return asyncio.run(with_database())
+    return run_scenario
+
+async def running_job(owner: User, **fields) -> CalculationJob:
+    image_id = await store_image_data(board_png(), "image/png")
+    job = CalculationJob(
+        owner_id=owner.id, image_id=image_id, content_type="image/png",
+        status="running", attempts=1, started_at=utc_now(), **fields
+    )
+    await job.insert()
+    return job
+
+def test_reintento_no_duplica_la_conversacion_nueva(run):
+    async def scenario(owner):
+        job = await running_job(owner)
+        first = await main.run_whiteboard_job(job)
+        second = await main.run_whiteboard_job(job)
+
+        assert first["conversation_id"] == second["conversation_id"] == str(job.id)
+        assert await Conversation.find(Conversation.owner_id == owner.id).count() == 1
+        conversation = await Conversation.get(first["conversation_id"])
+        assert len(conversation.messages) == conversation.message_count == 2
+        assert {message.job_id for message in conversation.messages} == {str(job.id)}
+    run(scenario)
+
+def test_reintento_no_duplica_mensajes_en_conversacion_existente(run):
+    async def scenario(owner):
+        conversation = Conversation(title="Sesión", owner_id=owner.id)
+        await conversation.insert()
+        job = await running_job(owner, conversation_id=str(conversation.id))
+        await main.run_whiteboard_job(job)
+        await main.run_whiteboard_job(job)
+
+        conversation = await Conversation.get(conversation.id)
+        assert len(conversation.messages) == conversation.message_count == 2
+
+        # Otro trabajo sobre la misma conversación sí agrega los suyos.
+        other = await running_job(owner, conversation_id=str(conversation.id))
+        await main.run_whiteboard_job(other)
+        conversation = await Conversation.get(conversation.id)
+        assert len(conversation.messages) == conversation.message_count == 4
+    run(scenario)
+
+def test_finish_de_un_intento_vencido_se_ignora(run):
+    async def scenario(owner):
+        job = await running_job(owner, max_attempts=3)
+        await job_queue.collection().update_one(
+            {"_id": job.id}, {"$set": {"started_at": utc_now() - timedelta(seconds=job_queue.timeout * 3)}}
+        )
+        completed = job_queue.completed
+
+        await job_queue.requeue_stale()
+        await job_queue.finish(job, "done", result={"intento": 1})
+        document = await job_queue.collection().find_one({"_id": job.id})
+        assert document["status"] == "queued" and document["result"] is None
+
+        await job_queue.collection().update_one({"_id": job.id}, {"$set": {"available_at": utc_now()}})
+        current = await job_queue.claim()
+        assert current.id == job.id and current.attempts == 2
+
+        await job_queue.finish(job, "done", result={"intento": 1})
+        await job_queue.retry_or_fail(job, {"status": 500, "detail": "tarde"})
+        document = await job_queue.collection().find_one({"_id": job.id})
+        assert document["status"] == "running" and document["result"] is None
+        assert job_queue.completed == completed
+
+        await job_queue.finish(current, "done", result={"intento": 2})
+        document = await job_queue.collection().find_one({"_id": job.id})
+        assert document["status"] == "done" and document["result"] == {"intento": 2}
+        assert job_queue.completed == completed + 1
+    run(scenario)
+
+def test_cola_llena_responde_503_sin_dejar_estado(run, monkeypatch):
+    monkeypatch.setattr(job_queue, "max_queue", 0)
+
+    async def scenario(owner):
+        rejected = job_queue.rejected
+        request = CalculateJobRequest(image="data:image/png;base64," + base64.b64encode(board_png()).decode())
+        with pytest.raises(HTTPException) as error:
+            await main.create_calculation_job(request, current_user=owner)
+
+        assert error.value.status_code == 503
+        assert int(error.value.headers["Retry-After"]) >= 1
+        assert job_queue.rejected == rejected + 1
+        assert await CalculationJob.count() == 0
+        assert await ImageBlob.count() == 0
+    run(scenario)
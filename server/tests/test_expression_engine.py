@@ -0,0 +1,67 @@
+import pytest
+
+from expression_engine import (
+    ExpressionError, EXPRESSION_MAX_DEPTH, EXPRESSION_MAX_LENGTH, compile_expression, evaluate
+)
+
+@pytest.mark.parametrize("expresion, esperado", [
+    ("(3 + 4) * 2 - 5 / 2", 11.5),
+    ("2^3^2", 512),
+    ("2**3", 8),
+    ("-2^2", -4),
+    ("2(3 + 1)", 8),
+    ("(1 + 1)(2 + 2)", 8),
+    ("1.5 + .5", 2),
+    ("sqrt(16) + log(100)", 6),
+])
+def test_evalua_expresiones_validas(expresion, esperado):
+    assert evaluate(expresion) == pytest.approx(esperado)
+
+def test_multiplicacion_implicita_con_variables():
+    assert evaluate("3x^2 - 2x", {"x": 2}) == pytest.approx(8)
+
+@pytest.mark.parametrize("expresion", ["1.2.3", "2 3", "1. 5", "(1 + 2.3.4)"])
+def test_rechaza_numeros_adyacentes(expresion):
+    with pytest.raises(ExpressionError):
+        evaluate(expresion)
+
+@pytest.mark.parametrize("expresion", [
+    "-" * 499 + "1",
+    "(" * 200 + "1" + ")" * 200,
+    "2^" * 150 + "2",
+    "(-" * 120 + "4" + ")" * 120,
+])
+def test_anidamiento_profundo_falla_con_expression_error(expresion):
+    assert len(expresion) <= EXPRESSION_MAX_LENGTH
+    with pytest.raises(ExpressionError):
+        evaluate(expresion)
+
+def test_anidamiento_dentro_del_limite():
+    profundidad = EXPRESSION_MAX_DEPTH // 2
+    assert evaluate("-" * profundidad + "1") == (-1) ** profundidad
+    assert evaluate("(" * profundidad + "1" + ")" * profundidad) == 1
+
+def test_cadena_larga_sin_anidamiento():
+    expresion = "+".join(["1"] * 250)
+    assert len(expresion) <= EXPRESSION_MAX_LENGTH
+    assert evaluate(expresion) == 250
+
+@pytest.mark.parametrize("expresion", ["", "2 +", "(1 + 2", "1 + 2)", "import os", "2 $ 3", "sqrt(1, 2)"])
+def test_rechaza_expresiones_invalidas(expresion):
+    with pytest.raises(ExpressionError):
+        evaluate(expresion)
+
+def test_rechaza_expresiones_largas():
+    with pytest.raises(ExpressionError):
+        compile_expression("1+" * EXPRESSION_MAX_LENGTH + "1")
+
+def test_rechaza_exponentes_grandes_y_division_por_cero():
+    with pytest.raises(ExpressionError):
+        evaluate("9^9^9")
+    with pytest.raises(ExpressionError):
+        evaluate("1 / (2 - 2)")
+
+@pytest.mark.parametrize("expresion, funcion", [("sqrt(-1)", "sqrt"), ("log(0)", "log"), ("2 + log(-5)", "log")])
+def test_fuera_del_dominio_falla_con_expression_error(expresion, funcion):
+    with pytest.raises(ExpressionError, match=funcion):
+        evaluate(expresion)
@@ -0,0 +1,14 @@
+import pytest
+
+from expression_engine import ExpressionError
+from mcp_tools import realizar_operacion
+
+def test_realizar_operacion_con_espacios():
+    resultado = realizar_operacion(" (3 + 4) * 2 ")
+    assert resultado["resultado"] == pytest.approx(14)
+    assert resultado["expresion_original"] == " (3 + 4) * 2 "
+
+@pytest.mark.parametrize("expresion", ["2 3", "1. 5", "sqrt(-1)", "log(0)"])
+def test_realizar_operacion_rechaza_expresiones_invalidas(expresion):
+    with pytest.raises(ExpressionError):
+        realizar_operacion(expresion)
@@ -0,0 +1,233 @@
+import os
+from dotenv import load_dotenv
+load_dotenv()
+
+import time
+import asyncio
+import logging
+import multiprocessing
+from collections.abc import Sized
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+
+from mcp_tools import TOOLS_FUNCTIONS
+from metrics import tool_duration, tool_calls
+
+TOOL_POOL_WORKERS = int(os.getenv("TOOL_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "5"))
+TOOL_MEMORY_LIMIT_MB = int(os.getenv("TOOL_MEMORY_LIMIT_MB", "1024"))
+TOOL_INLINE_MAX_LENGTH = int(os.getenv("TOOL_INLINE_MAX_LENGTH", "64"))
+TOOL_INLINE_MAX_ITEMS = int(os.getenv("TOOL_INLINE_MAX_ITEMS", "100"))
+
+class ToolTimeoutError(Exception):
+    pass
+
+class PoolReplacedError(Exception):
+    # La llamada cayó porque otra reciclaba el pool, no por un fallo propio.
+    pass
+
+# Herramientas baratas o que dependen del estado del proceso (el banco de
+# ejercicios) siempre corren en el mismo proceso.
+INLINE_TOOLS = {"resolver_ecuacion_lineal", "resolver_ecuacion_cuadratica", "generar_ejercicio"}
+
+def is_simple_expression(expresion) -> bool:
+    texto = str(expresion)
+    return len(texto) <= TOOL_INLINE_MAX_LENGTH and "^" not in texto and "**" not in texto
+
+def runs_inline(tool_name: str, tool_args: dict) -> bool:
+    if tool_name in INLINE_TOOLS:
+        return True
+    if tool_name == "realizar_operacion":
+        return is_simple_expression(tool_args.get("expresion", ""))
+    if tool_name == "tabla_de_valores":
+        try:
+            paso = float(tool_args.get("paso", 1))
+            puntos = (float(tool_args["hasta"]) - float(tool_args["desde"])) / paso
+        except (KeyError, TypeError, ValueError, ZeroDivisionError):
+            return True
+        return puntos <= TOOL_INLINE_MAX_ITEMS and is_simple_expression(tool_args.get("expresion", ""))
+    if tool_name in ("resolver_lote_lineal", "resolver_lote_cuadratico"):
+        columna = tool_args.get("m", tool_args.get("a", []))
+        if isinstance(columna, (str, bytes)) or not isinstance(columna, Sized):
+            return True
+        return len(columna) <= TOOL_INLINE_MAX_ITEMS
+    return True
+
+def limit_worker_memory(limit_mb: int):
+    if limit_mb <= 0:
+        return
+    try:
+        import resource
+    except ImportError:
+        # Windows no tiene RLIMIT_AS; el límite de tiempo sigue aplicando.
+        return
+    limit = limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def run_in_worker(tool_name: str, tool_args: dict):
+    # Las excepciones se re-crean con tipos simples porque algunas (p. ej. las
+    # de pydantic) no se pueden serializar de vuelta al proceso principal.
+    try:
+        return TOOLS_FUNCTIONS[tool_name](**tool_args)
+    except MemoryError:
+        raise RuntimeError("La herramienta superó el límite de memoria")
+    except ValueError as e:
+        raise ValueError(str(e))
+    except TypeError as e:
+        raise TypeError(str(e))
+    except Exception as e:
+        raise RuntimeError(str(e))
+
+def ping_worker() -> int:
+    return os.getpid()
+
+def new_tool_stats() -> dict:
+    return {"calls": 0, "inline": 0, "pool": 0, "errors": 0, "timeouts": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+
+class ToolExecutor:
+    def __init__(self, workers: int, timeout: float, memory_limit_mb: int):
+        self.workers = workers
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop = None
+        self.recycled = 0
+        self.resubmitted = 0
+        self.stats_by_tool: dict[str, dict] = {}
+
+    def create_pool(self) -> ProcessPoolExecutor:
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=limit_worker_memory,
+            initargs=(self.memory_limit_mb,)
+        )
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = self.create_pool()
+        return self._pool
+
+    @property
+    def slots(self) -> asyncio.Semaphore:
+        # Una llamada por proceso: el tiempo máximo corre desde que un proceso la
+        # toma, no mientras espera en la cola.
+        loop = asyncio.get_running_loop()
+        if self._slots is None or self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.workers)
+            self._slots_loop = loop
+        return self._slots
+
+    async def warm_up(self):
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[
+            loop.run_in_executor(self.pool, ping_worker) for _ in range(self.workers)
+        ])
+        print(f"Pool de herramientas listo con {len(set(pids))} proceso(s)")
+
+    def recycle(self, pool: ProcessPoolExecutor):
+        # Un proceso colgado no se puede cancelar: se terminan los procesos del
+        # pool y el siguiente uso crea uno nuevo. Si otra llamada ya lo reemplazó,
+        # no se toca el pool nuevo.
+        if pool is None or self._pool is not pool:
+            return
+        self._pool = None
+        self.recycled += 1
+        processes = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def record(self, tool_name: str, mode: str, elapsed: float, outcome: str):
+        stats = self.stats_by_tool.setdefault(tool_name, new_tool_stats())
+        stats["calls"] += 1
+        stats[mode] += 1
+        stats["total_seconds"] += elapsed
+        stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+        if outcome != "ok":
+            stats[outcome] += 1
+        tool_duration.observe(elapsed, tool=tool_name, mode=mode)
+        tool_calls.inc(tool=tool_name, outcome=outcome)
+
+    async def submit(self, tool_name: str, tool_args: dict):
+        loop = asyncio.get_running_loop()
+        async with self.slots:
+            pool = self.pool
+            future = loop.run_in_executor(pool, run_in_worker, tool_name, tool_args)
+            try:
+                return await asyncio.wait_for(future, timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.recycle(pool)
+                raise ToolTimeoutError(f"La herramienta {tool_name} superó el tiempo máximo de {self.timeout:g} s")
+            except BrokenProcessPool:
+                if self._pool is not pool:
+                    raise PoolReplacedError()
+                self.recycle(pool)
+                raise RuntimeError(f"El proceso que ejecutaba {tool_name} terminó inesperadamente")
+            except asyncio.CancelledError:
+                # shutdown(cancel_futures=True) de otra llamada cancela lo pendiente.
+                if future.cancelled() and self._pool is not pool and not asyncio.current_task().cancelling():
+                    raise PoolReplacedError()
+                raise
+
+    async def run_in_pool(self, tool_name: str, tool_args: dict):
+        try:
+            return await self.submit(tool_name, tool_args)
+        except PoolReplacedError:
+            self.resubmitted += 1
+        try:
+            return await self.submit(tool_name, tool_args)
+        except PoolReplacedError:
+            raise RuntimeError(f"El proceso que ejecutaba {tool_name} terminó inesperadamente")
+
+    async def run(self, tool_name: str, tool_args: dict):
+        if tool_name not in TOOLS_FUNCTIONS:
+            raise KeyError(tool_name)
+
+        mode = "inline" if runs_inline(tool_name, tool_args) else "pool"
+        outcome = "ok"
+        start = time.perf_counter()
+        try:
+            if mode == "inline":
+                return TOOLS_FUNCTIONS[tool_name](**tool_args)
+            return await self.run_in_pool(tool_name, tool_args)
+        except ToolTimeoutError:
+            outcome = "timeouts"
+            raise
+        except Exception:
+            outcome = "errors"
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.record(tool_name, mode, elapsed, outcome)
+            if outcome == "timeouts":
+                logging.warning(f"Herramienta {tool_name} cancelada tras {elapsed:.2f} s")
+
+    def stats(self) -> dict:
+        tools = {}
+        for tool_name, stats in self.stats_by_tool.items():
+            tools[tool_name] = {
+                **stats,
+                "avg_seconds": stats["total_seconds"] / stats["calls"] if stats["calls"] else 0.0,
+            }
+        return {
+            "workers": self.workers,
+            "timeout": self.timeout,
+            "memory_limit_mb": self.memory_limit_mb,
+            "recycled": self.recycled,
+            "resubmitted": self.resubmitted,
+            "tools": tools,
+        }
+
+tool_executor = ToolExecutor(TOOL_POOL_WORKERS, TOOL_TIMEOUT, TOOL_MEMORY_LIMIT_MB)